@@ -0,0 +1,97 @@
+# Copyright (c) 2023 SUSE LLC.  All rights reserved.
+#
+# This file is part of mqsf.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+
+"""
+Microbenchmark of the JsonFormat encodings and backends.
+
+Run from the repository root, mqsf has to be importable:
+
+    PYTHONPATH=. python benchmarks/bench_json_format.py [--number N]
+"""
+
+import argparse
+import timeit
+
+from mqsf.json_format import BACKENDS, JsonFormat, orjson
+
+
+def get_job(size):
+    """
+    Return a job config resembling a wx style message with payload.
+    """
+    return {
+        'id': '4711',
+        'status': 'success',
+        'routing_key': 'user.wx',
+        'data_type': 'forecast',
+        'errors': [],
+        'wx_data': {
+            'day_{0}'.format(day): {
+                'High Temp': '15C',
+                'Low Temp': '10C',
+                'Humidity': '56%',
+                'Summary': 'Partly cloudy with a chance of rain.'
+            } for day in range(size)
+        }
+    }
+
+
+def bench(label, func, number):
+    seconds = timeit.timeit(func, number=number)
+    print(
+        '{0:<28} {1:>10.2f} us/op'.format(label, seconds / number * 1e6)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=2000)
+    parser.add_argument('--size', type=int, default=50)
+    args = parser.parse_args()
+
+    job = get_job(args.size)
+    pretty = JsonFormat.json_message(job)
+    compact = JsonFormat.json_compact(job)
+
+    print('pretty size:  {0} bytes'.format(len(pretty)))
+    print('compact size: {0} bytes'.format(len(compact)))
+
+    bench('encode pretty', lambda: JsonFormat.json_message(job), args.number)
+
+    for backend in BACKENDS:
+        if backend == 'orjson' and not orjson:
+            print('{0:<28} {1:>10}'.format('orjson', 'not installed'))
+            continue
+
+        JsonFormat.set_backend(backend)
+        bench(
+            'encode compact ({0})'.format(backend),
+            lambda: JsonFormat.json_compact(job),
+            args.number
+        )
+        bench(
+            'decode ({0})'.format(backend),
+            lambda: JsonFormat.json_loads(compact),
+            args.number
+        )
+
+    JsonFormat.set_backend()
+
+
+if __name__ == '__main__':
+    main()
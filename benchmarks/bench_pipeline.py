@@ -0,0 +1,381 @@
+# Copyright (c) 2023 SUSE LLC.  All rights reserved.
+#
+# This file is part of mqsf.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+
+"""
+End-to-end throughput benchmark of MessageService on the fake broker.
+
+A pipeline of services runs in one process, each hop consumes the
+status messages of the previous hop. Jobs are published to the first
+hop at once and collected after the last hop. Reports messages per
+second, latency percentiles per hop and memory usage.
+
+Run from the repository root, mqsf has to be importable:
+
+    PYTHONPATH=. python benchmarks/bench_pipeline.py [--messages N]
+        [--hops N] [--plugin noop|sleep|cpu] [--work N] [--async]
+        [--in-process] [--set key=value ...]
+"""
+
+import argparse
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import yaml
+
+from mqsf import hookimpl, plugin_manager
+from mqsf.async_message_service import AsyncMessageService
+from mqsf.codec import get_codec
+from mqsf.config.base_config import BaseConfig
+from mqsf.fake_broker import FakeBroker, FakeConnectionManager
+from mqsf.message_service import MessageService
+from mqsf.transport import InProcessTransport
+
+EXCHANGE = 'bench'
+SOURCE = 'source'
+SINK_QUEUE = 'bench.sink'
+
+
+class SleepPlugin(object):
+    """
+    Plugin waiting work milliseconds, resembles I/O bound jobs.
+    """
+    @staticmethod
+    def run_task(service, job_config, log):
+        time.sleep(job_config['work'] / 1000.0)
+
+
+class CpuPlugin(object):
+    """
+    Plugin looping work thousand times, resembles CPU bound jobs.
+    """
+    @staticmethod
+    def run_task(service, job_config, log):
+        total = 0
+        for index in range(job_config['work'] * 1000):
+            total += index
+
+
+PLUGINS = {
+    'sleep': SleepPlugin,
+    'cpu': CpuPlugin
+}
+
+
+class Tracer(object):
+    """
+    Record the lifecycle timestamps of jobs per service.
+    """
+    def __init__(self):
+        self.received = {}
+        self.published = {}
+
+    @hookimpl
+    def mqsf_message_received(self, service, job_id, timestamp, metadata):
+        self.received[(service.service_name, job_id)] = timestamp
+
+    @hookimpl
+    def mqsf_message_published(self, service, job_id, timestamp, metadata):
+        self.published.setdefault((service.service_name, job_id), timestamp)
+
+
+def get_service_class(base_class, services):
+    """
+    Return a service class collecting its instances in services.
+
+    Services consume in their constructor, the instances are needed
+    to stop them.
+    """
+    class BenchService(base_class):
+        def post_init(self):
+            services.append(self)
+            super(BenchService, self).post_init()
+
+    return BenchService
+
+
+def write_config(directory, service_name, prev_service, settings):
+    """
+    Write the config file of the service and return the config.
+    """
+    config = {
+        'mq_exchange': EXCHANGE,
+        'mq_routing_key': '{0}.{1}'.format(EXCHANGE, prev_service),
+        'previous_service': prev_service,
+        'base_job_dir': os.path.join(directory, 'jobs'),
+        'log_dir': os.path.join(directory, 'logs', ''),
+        'no_op_okay': False
+    }
+    config.update(settings)
+
+    config_file = os.path.join(directory, service_name + '_config.yaml')
+    with open(config_file, 'w') as yaml_file:
+        yaml.safe_dump(config, yaml_file)
+
+    return BaseConfig(config_file)
+
+
+def parse_settings(settings):
+    """
+    Return the config settings from key=value arguments.
+    """
+    result = {}
+
+    for setting in settings:
+        key, value = setting.split('=', 1)
+        result[key] = yaml.safe_load(value)
+
+    return result
+
+
+def percentiles(values):
+    """
+    Return the p50, p95, p99 and max of the values in milliseconds.
+    """
+    if not values:
+        return [float('nan')] * 4
+
+    values = sorted(values)
+    last = len(values) - 1
+
+    return [
+        values[int(round(last * percent / 100.0))] * 1000
+        for percent in (50, 95, 99, 100)
+    ]
+
+
+def report(label, values):
+    print('{0:<24} {1:>10.2f} {2:>10.2f} {3:>10.2f} {4:>10.2f}'.format(
+        label,
+        *percentiles(values)
+    ))
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+
+    while not condition():
+        if time.monotonic() > deadline:
+            raise RuntimeError('Timed out waiting for the pipeline.')
+
+        time.sleep(0.01)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--hops', type=int, default=1)
+    parser.add_argument(
+        '--plugin',
+        choices=['noop'] + sorted(PLUGINS),
+        default='noop'
+    )
+    parser.add_argument(
+        '--work',
+        type=int,
+        default=1,
+        help='Milliseconds to sleep or thousand loops per job.'
+    )
+    parser.add_argument(
+        '--async',
+        dest='use_async',
+        action='store_true',
+        help='Run jobs with AsyncMessageService.'
+    )
+    parser.add_argument(
+        '--in-process',
+        action='store_true',
+        help='Hand job dicts between services without serialization.'
+    )
+    parser.add_argument(
+        '--set',
+        dest='settings',
+        action='append',
+        default=[],
+        metavar='KEY=VALUE',
+        help='Service config setting, value is parsed as yaml.'
+    )
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument(
+        '--tracemalloc',
+        action='store_true',
+        help='Report peak Python memory, slows down the run.'
+    )
+    args = parser.parse_args()
+
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    directory = tempfile.mkdtemp(prefix='mqsf-bench-')
+    settings = parse_settings(args.settings)
+
+    if args.plugin == 'noop':
+        # The no op plugin of mqsf measures the framework overhead
+        plugin_name = 'NoOpJob'
+        settings.setdefault('no_op_okay', True)
+    else:
+        plugin_name = 'bench_{0}'.format(args.plugin)
+        plugin_manager.register(PLUGINS[args.plugin], plugin_name)
+
+    tracer = Tracer()
+    plugin_manager.register(tracer, 'bench_tracer')
+
+    broker = FakeBroker()
+    if args.in_process:
+        transport = InProcessTransport(broker)
+    else:
+        transport = FakeConnectionManager(broker)
+
+    services = []
+    service_class = get_service_class(
+        AsyncMessageService if args.use_async else MessageService,
+        services
+    )
+    names = [SOURCE] + [
+        'hop{0}'.format(hop) for hop in range(1, args.hops + 1)
+    ]
+    threads = []
+
+    for prev_service, service_name in zip(names, names[1:]):
+        config = write_config(directory, service_name, prev_service, settings)
+        thread = threading.Thread(
+            target=service_class,
+            args=(service_name,),
+            kwargs={
+                'config': config,
+                'transport': transport
+            },
+            daemon=True
+        )
+        thread.start()
+        threads.append(thread)
+
+    wait_for(
+        lambda: len(services) == args.hops and all(
+            service.channel.consumer_tags for service in services
+        ),
+        args.timeout
+    )
+
+    codec = transport.codec or get_codec()
+    channel = transport.channel()
+    channel.exchange.declare(exchange=EXCHANGE, exchange_type='topic')
+    channel.queue.declare(queue=SINK_QUEUE)
+    channel.queue.bind(
+        queue=SINK_QUEUE,
+        exchange=EXCHANGE,
+        routing_key='{0}.{1}'.format(EXCHANGE, names[-1])
+    )
+
+    done = {}
+
+    def collect(message):
+        job = get_codec(
+            message.properties.get('content_type')
+        ).decode(message.body)
+        done[job['id']] = time.monotonic()
+        message.ack()
+
+    channel.basic.consume(callback=collect, queue=SINK_QUEUE)
+
+    sent = {}
+    start = time.monotonic()
+
+    for index in range(args.messages):
+        job_id = 'job-{0}'.format(index)
+        sent[job_id] = time.monotonic()
+        channel.basic.publish(
+            body=codec.encode({
+                'id': job_id,
+                'status': 'success',
+                'plugin': plugin_name,
+                'work': args.work
+            }),
+            routing_key='{0}.{1}'.format(EXCHANGE, SOURCE),
+            exchange=EXCHANGE,
+            properties={'content_type': codec.content_type}
+        )
+
+    deadline = start + args.timeout
+    while len(done) < args.messages:
+        if time.monotonic() > deadline:
+            raise RuntimeError('Timed out waiting for the pipeline.')
+
+        channel.process_data_events()
+
+    elapsed = max(done.values()) - start
+
+    print('messages:    {0}'.format(args.messages))
+    print('hops:        {0}'.format(args.hops))
+    print('plugin:      {0} (work {1})'.format(args.plugin, args.work))
+    print('service:     {0}'.format(type(services[0]).__mro__[1].__name__))
+    print('transport:   {0}'.format(type(transport).__name__))
+    print('elapsed:     {0:.2f} s'.format(elapsed))
+    print('throughput:  {0:.0f} msg/s'.format(args.messages / elapsed))
+    print('max rss:     {0:.1f} MiB'.format(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    ))
+
+    if args.tracemalloc:
+        print('peak traced: {0:.1f} MiB'.format(
+            tracemalloc.get_traced_memory()[1] / 1024.0 / 1024.0
+        ))
+
+    print()
+    print('{0:<24} {1:>10} {2:>10} {3:>10} {4:>10}'.format(
+        'latency (ms)', 'p50', 'p95', 'p99', 'max'
+    ))
+
+    for prev_service, service_name in zip(names, names[1:]):
+        queued = []
+        in_service = []
+
+        for job_id in sent:
+            received = tracer.received[(service_name, job_id)]
+
+            if prev_service == SOURCE:
+                queued.append(received - sent[job_id])
+            else:
+                queued.append(
+                    received - tracer.published[(prev_service, job_id)]
+                )
+
+            in_service.append(
+                tracer.published[(service_name, job_id)] - received
+            )
+
+        report('{0} queued'.format(service_name), queued)
+        report('{0} in service'.format(service_name), in_service)
+
+    report('end to end', [done[job_id] - sent[job_id] for job_id in sent])
+
+    for service in services:
+        service.stop()
+
+    for thread in threads:
+        thread.join(timeout=30)
+
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
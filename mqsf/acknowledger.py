@@ -0,0 +1,121 @@
+# Copyright (c) 2023 SUSE LLC.  All rights reserved.
+#
+# This file is part of mqsf.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+
+class BatchAcknowledger(object):
+    """
+    Coalesce message acknowledgements on a consumer channel.
+
+    Delivery tags are collected and acknowledged with a single
+    basic.ack using multiple=True once the batch size is reached
+    or the oldest pending tag has waited longer than max_delay.
+
+    Tags can be held while the work they represent is still in
+    progress. A cumulative ack never covers a held tag, completed
+    tags above the oldest held one are acknowledged individually.
+
+    Attributes
+
+    * :attr:`channel`
+      Channel the messages were delivered on
+
+    * :attr:`batch_size`
+      Number of acknowledgements to coalesce
+
+    * :attr:`max_delay`
+      Seconds an acknowledgement may be held back
+    """
+    def __init__(self, channel, batch_size=1, max_delay=1.0):
+        self.channel = channel
+        self.batch_size = max(batch_size, 1)
+        self.max_delay = max_delay
+        self.lock = threading.RLock()
+
+        self._held = set()
+        self._pending = []
+        self._pending_since = None
+
+    def hold(self, delivery_tag):
+        """
+        Register a delivery tag that will be acknowledged later.
+        """
+        with self.lock:
+            self._held.add(delivery_tag)
+
+    def ack(self, delivery_tag):
+        """
+        Queue the delivery tag and flush if the batch is full.
+        """
+        with self.lock:
+            self._held.discard(delivery_tag)
+            self._pending.append(delivery_tag)
+
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    @property
+    def unacked(self):
+        """
+        Return the number of held and pending delivery tags.
+        """
+        with self.lock:
+            return len(self._held) + len(self._pending)
+
+    def flush(self, force=True):
+        """
+        Acknowledge all pending delivery tags.
+
+        If force is False the tags are only acknowledged once the
+        oldest one has been held for at least max_delay seconds.
+        """
+        with self.lock:
+            if not self._pending:
+                return
+
+            waited = time.monotonic() - self._pending_since
+            if force or waited >= self.max_delay:
+                self._flush()
+
+    def _flush(self):
+        """
+        Send a cumulative ack for the pending tags below any held tag.
+        """
+        floor = min(self._held) if self._held else None
+        below = [tag for tag in self._pending if floor is None or tag < floor]
+        above = [
+            tag for tag in self._pending if floor is not None and tag > floor
+        ]
+
+        if self.channel.is_open:
+            if below:
+                self.channel.basic.ack(
+                    delivery_tag=max(below),
+                    multiple=len(below) > 1
+                )
+
+            for tag in above:
+                self.channel.basic.ack(delivery_tag=tag)
+
+        self._pending = []
+        self._pending_since = None
@@ -0,0 +1,189 @@
+# Copyright (c) 2023 SUSE LLC.  All rights reserved.
+#
+# This file is part of mqsf.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+
+import asyncio
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+
+from apscheduler import events
+from apscheduler.events import JobExecutionEvent
+
+from pytz import utc
+
+from mqsf.message_service import MessageService
+
+
+class AsyncMessageService(MessageService):
+    """
+    Message service running jobs as coroutines on an asyncio loop.
+
+    Plugins implementing the run_task_async hook are awaited on the
+    loop, so I/O bound jobs do not hold a thread while they wait.
+    Plugins only implementing run_task are offloaded to a thread pool.
+    Jobs configured for a process executor still run in the scheduler.
+    The default executor runs up to async_max_concurrency jobs.
+
+    AMQP consumption stays on the consumer thread, jobs are handed to
+    the loop thread as they are scheduled.
+    """
+    def start(self):
+        """
+        Start the event loop thread and the listener service.
+        """
+        self.loop = asyncio.new_event_loop()
+        self.offload_executor = ThreadPoolExecutor(
+            max_workers=self.config.get_base_thread_pool_count(),
+            thread_name_prefix='offload'
+        )
+        self.loop.set_default_executor(self.offload_executor)
+        self.running_jobs = set()
+
+        self.loop_thread = threading.Thread(
+            target=self.loop.run_forever,
+            name='asyncio',
+            daemon=True
+        )
+        self.loop_thread.start()
+
+        super(AsyncMessageService, self).start()
+
+    def _get_default_workers(self):
+        """
+        Return the max number of jobs running at once on the loop.
+        """
+        return self.config.get_async_max_concurrency()
+
+    def _submit_job(self, job_id, executor):
+        """
+        Schedule new job or batch on the event loop based on id.
+
+        The dispatcher limits the number of jobs running at once per
+        executor, for thread executors these run as coroutines.
+        """
+        if self.executor_types[executor] == 'process':
+            super(AsyncMessageService, self)._submit_job(job_id, executor)
+            return
+
+        future = asyncio.run_coroutine_threadsafe(
+            self._run_job(job_id),
+            self.loop
+        )
+        self.running_jobs.add(future)
+        future.add_done_callback(self.running_jobs.discard)
+
+    async def _run_job(self, job_id):
+        """
+        Run the job and process the result like a scheduler job.
+        """
+        exception = None
+        traceback = None
+
+        try:
+            await self._start_job_async(job_id)
+        except Exception as error:
+            exception = error
+            traceback = sys.exc_info()[2]
+
+        event = JobExecutionEvent(
+            events.EVENT_JOB_ERROR if exception else events.EVENT_JOB_EXECUTED,
+            job_id,
+            'default',
+            datetime.now(utc),
+            exception=exception,
+            traceback=traceback
+        )
+
+        # Result processing publishes and writes to disk
+        await self.loop.run_in_executor(
+            None,
+            self._handle_job_event,
+            event
+        )
+
+    async def _start_job_async(self, job_id):
+        """
+        Process job based on job id.
+        """
+        if job_id in self.batches:
+            await self.loop.run_in_executor(None, self._start_batch, job_id)
+            return
+
+        job_config = await self.loop.run_in_executor(
+            None,
+            self._load_job,
+            job_id
+        )
+
+        try:
+            plugin = self.job_factory.create_job(job_config)
+        except Exception:
+            # Let the factory log and record the invalid job
+            await self.loop.run_in_executor(
+                None,
+                self._start_job,
+                job_id
+            )
+            return
+
+        self._notify_job_started(job_id)
+        start = time.monotonic()
+
+        try:
+            if hasattr(plugin, 'run_task_async'):
+                await plugin.run_task_async(self, job_config, self.log)
+            else:
+                await self.loop.run_in_executor(
+                    None,
+                    plugin.run_task,
+                    self,
+                    job_config,
+                    self.log
+                )
+        finally:
+            self.job_duration.observe(
+                time.monotonic() - start,
+                service=self.service_name
+            )
+
+    def stop(self, signum=None, frame=None):
+        """
+        Wait for running jobs, then stop the loop and the service.
+
+        Consuming stops first so no new jobs are submitted. Finished
+        jobs may still start waiting jobs, wait until none is left.
+        """
+        if not hasattr(self, 'loop'):
+            # Stopped before the service started
+            super(AsyncMessageService, self).stop(signum, frame)
+            return
+
+        if self.channel and self.channel.is_open:
+            self.channel.stop_consuming()
+
+        while self.running_jobs:
+            wait(list(self.running_jobs))
+
+        super(AsyncMessageService, self).stop(signum, frame)
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
+        self.offload_executor.shutdown(wait=True)
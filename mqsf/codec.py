@@ -0,0 +1,126 @@
+# Copyright (c) 2023 SUSE LLC.  All rights reserved.
+#
+# This file is part of mqsf.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+
+from mqsf.exceptions import MQSFCodecException
+from mqsf.json_format import JsonFormat
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+JSON_CONTENT_TYPE = 'application/json'
+MSGPACK_CONTENT_TYPE = 'application/msgpack'
+CBOR_CONTENT_TYPE = 'application/cbor'
+
+
+class JsonCodec(object):
+    """
+    Codec for json encoded messages.
+    """
+    content_type = JSON_CONTENT_TYPE
+
+    @staticmethod
+    def encode(data):
+        return JsonFormat.json_compact(data)
+
+    @staticmethod
+    def decode(body):
+        return JsonFormat.json_loads(body)
+
+
+class MsgpackCodec(object):
+    """
+    Codec for MessagePack encoded messages.
+    """
+    content_type = MSGPACK_CONTENT_TYPE
+
+    @staticmethod
+    def encode(data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    @staticmethod
+    def decode(body):
+        return msgpack.unpackb(body, raw=False)
+
+
+class CborCodec(object):
+    """
+    Codec for CBOR encoded messages.
+    """
+    content_type = CBOR_CONTENT_TYPE
+
+    @staticmethod
+    def encode(data):
+        return cbor2.dumps(data)
+
+    @staticmethod
+    def decode(body):
+        return cbor2.loads(body)
+
+
+codecs = {}
+"""Registered codecs keyed by AMQP content type"""
+
+
+def register_codec(codec, aliases=()):
+    """
+    Register the codec for its content type and any aliases.
+    """
+    codecs[codec.content_type] = codec
+
+    for alias in aliases:
+        codecs[alias] = codec
+
+
+def get_codec(content_type=None):
+    """
+    Return the codec for the content type.
+
+    Messages without a content type are treated as json, which is
+    what every mqsf service published before codecs were added.
+    """
+    content_type = content_type or JSON_CONTENT_TYPE
+
+    if isinstance(content_type, bytes):
+        content_type = content_type.decode('utf-8')
+
+    # Ignore parameters such as charset=utf-8
+    content_type = content_type.split(';')[0].strip().lower()
+
+    try:
+        return codecs[content_type]
+    except KeyError:
+        raise MQSFCodecException(
+            'No codec available for content type {0}.'.format(content_type)
+        )
+
+
+register_codec(JsonCodec, aliases=('text/json',))
+
+if msgpack:
+    register_codec(MsgpackCodec, aliases=('application/x-msgpack',))
+
+if cbor2:
+    register_codec(CborCodec)
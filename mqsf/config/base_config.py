@@ -24,6 +24,7 @@ from mqsf.exceptions import MQSFConfigException
 
 # Default config values
 DEFAULT_CONFIG_FILE = '/etc/mqsf/mqsf_config.yaml'
+SERVICE_CONFIG_FILE_TEMPLATE = '/etc/mqsf/{0}_config.yaml'
 DEFAULT_MQ_HOST = 'localhost'
 DEFAULT_MQ_USER = 'guest'
 DEFAULT_MQ_PASS = 'guest'
@@ -38,6 +39,39 @@ DEFAULT_BASE_JOB_DIRECTORY = '/var/lib/mqsf/'
 DEFAULT_NO_OP_OKAY = True
 DEFAULT_BASE_THREAD_POOL_COUNT = 10
 DEFAULT_PLUGIN_KEY = 'plugin'
+DEFAULT_PREFETCH_COUNT = 0
+DEFAULT_ACK_BATCH_SIZE = 1
+DEFAULT_ACK_BATCH_TIMEOUT = 1.0
+DEFAULT_DEFERRED_ACK = False
+DEFAULT_MAX_UNACKED_JOBS = 100
+DEFAULT_PUBLISH_CONFIRM_MODE = 'sync'
+DEFAULT_PUBLISH_CONFIRM_WINDOW = 100
+DEFAULT_PUBLISH_RETRY_COUNT = 3
+DEFAULT_MESSAGE_CONTENT_TYPE = 'application/json'
+DEFAULT_JOB_STORE = 'file'
+DEFAULT_JOB_STORE_SYNC = 'none'
+DEFAULT_JOURNAL_SEGMENT_SIZE = 64 * 1024 * 1024
+DEFAULT_JOB_STORE_COMMIT_WINDOW = 0.0
+DEFAULT_JOURNAL_COMPACTION_INTERVAL = 60
+DEFAULT_RECOVERY_THREADS = 4
+DEFAULT_EXECUTOR_TYPE = 'thread'
+DEFAULT_ASYNC_MAX_CONCURRENCY = 1000
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_BATCH_WINDOW = 0.1
+DEFAULT_LOG_SHIPPING = 'sync'
+DEFAULT_LOG_QUEUE_SIZE = 10000
+DEFAULT_LOG_BATCH_SIZE = 100
+DEFAULT_LOG_OVERFLOW = 'drop'
+DEFAULT_LOG_ASYNC_WRITE = False
+DEFAULT_LOG_ROTATION = 'none'
+DEFAULT_LOG_MAX_BYTES = 100 * 1024 * 1024
+DEFAULT_LOG_ROTATION_INTERVAL = 'midnight'
+DEFAULT_LOG_BACKUP_COUNT = 7
+DEFAULT_LOG_COMPRESS = False
+DEFAULT_METRICS_HOST = '127.0.0.1'
+DEFAULT_TRANSPORT = 'amqp'
+DEFAULT_WORKER_PROCESSES = 1
+DEFAULT_DEDUP_MAX_SIZE = 1000000
 
 
 class BaseConfig(object):
@@ -135,9 +169,13 @@ class BaseConfig(object):
         :rtype: string
         """
         mq_heartbeat = self._get_attribute(
-            attribute='mq_hearbeat'
+            attribute='mq_heartbeat'
         )
 
+        if mq_heartbeat is None:
+            # Misspelled attribute read by previous versions
+            mq_heartbeat = self._get_attribute(attribute='mq_hearbeat')
+
         return mq_heartbeat or DEFAULT_MQ_HEARTBEAT
 
     def get_mq_exchange(self):
@@ -201,6 +239,155 @@ class BaseConfig(object):
             dir=log_dir, service=service
         )
 
+    def get_log_shipping(self):
+        """
+        Return how log records are shipped to MQ, either sync or async.
+
+        :rtype: string
+        """
+        log_shipping = self._get_attribute(attribute='log_shipping')
+        log_shipping = log_shipping or DEFAULT_LOG_SHIPPING
+
+        if log_shipping not in ('sync', 'async'):
+            raise MQSFConfigException(
+                'log_shipping must be sync or async.'
+            )
+
+        return log_shipping
+
+    def get_log_queue_size(self):
+        """
+        Return the max number of log records waiting to be shipped.
+
+        :return: int
+        """
+        log_queue_size = self._get_attribute(attribute='log_queue_size')
+        return log_queue_size or DEFAULT_LOG_QUEUE_SIZE
+
+    def get_log_batch_size(self):
+        """
+        Return the max number of log records shipped at once.
+
+        :return: int
+        """
+        log_batch_size = self._get_attribute(attribute='log_batch_size')
+        return log_batch_size or DEFAULT_LOG_BATCH_SIZE
+
+    def get_log_overflow(self):
+        """
+        Return the policy for log records when the queue is full.
+
+        Either drop, block or spill to the spill file.
+
+        :rtype: string
+        """
+        log_overflow = self._get_attribute(attribute='log_overflow')
+        log_overflow = log_overflow or DEFAULT_LOG_OVERFLOW
+
+        if log_overflow not in ('drop', 'block', 'spill'):
+            raise MQSFConfigException(
+                'log_overflow must be drop, block or spill.'
+            )
+
+        return log_overflow
+
+    def get_log_spill_file(self, service):
+        """
+        Return the file log records spill to if the queue is full.
+
+        :rtype: string
+        """
+        log_dir = self.get_log_directory()
+        return '{dir}{service}_log_spill.jsonl'.format(
+            dir=log_dir, service=service
+        )
+
+    def get_metrics_port(self):
+        """
+        Return the port metrics are served on, None if disabled.
+
+        :return: int
+        """
+        return self._get_attribute(attribute='metrics_port')
+
+    def get_metrics_host(self):
+        """
+        Return the address the metrics server listens on.
+
+        :rtype: string
+        """
+        metrics_host = self._get_attribute(attribute='metrics_host')
+        return metrics_host or DEFAULT_METRICS_HOST
+
+    def get_log_async_write(self):
+        """
+        Return True if the log file is written from a background thread.
+
+        :return: bool
+        """
+        log_async_write = self._get_attribute(attribute='log_async_write')
+        if log_async_write is None:
+            return DEFAULT_LOG_ASYNC_WRITE
+        return log_async_write
+
+    def get_log_rotation(self):
+        """
+        Return the log file rotation type, either none, size or time.
+
+        :rtype: string
+        """
+        log_rotation = self._get_attribute(attribute='log_rotation')
+        log_rotation = log_rotation or DEFAULT_LOG_ROTATION
+
+        if log_rotation not in ('none', 'size', 'time'):
+            raise MQSFConfigException(
+                'log_rotation must be none, size or time.'
+            )
+
+        return log_rotation
+
+    def get_log_max_bytes(self):
+        """
+        Return the size in bytes a log file is rotated at.
+
+        :return: int
+        """
+        log_max_bytes = self._get_attribute(attribute='log_max_bytes')
+        return log_max_bytes or DEFAULT_LOG_MAX_BYTES
+
+    def get_log_rotation_interval(self):
+        """
+        Return the interval type a log file is rotated at, e.g. midnight.
+
+        :rtype: string
+        """
+        log_rotation_interval = self._get_attribute(
+            attribute='log_rotation_interval'
+        )
+        return log_rotation_interval or DEFAULT_LOG_ROTATION_INTERVAL
+
+    def get_log_backup_count(self):
+        """
+        Return the number of rotated log files to keep.
+
+        :return: int
+        """
+        log_backup_count = self._get_attribute(attribute='log_backup_count')
+        if log_backup_count is None:
+            return DEFAULT_LOG_BACKUP_COUNT
+        return log_backup_count
+
+    def get_log_compress(self):
+        """
+        Return True if rotated log files are compressed with gzip.
+
+        :return: bool
+        """
+        log_compress = self._get_attribute(attribute='log_compress')
+        if log_compress is None:
+            return DEFAULT_LOG_COMPRESS
+        return log_compress
+
     def get_job_directory(self, service_name):
         """
         Return job directory path based on service name attribute.
@@ -253,3 +440,360 @@ class BaseConfig(object):
         """
         plugin_key = self._get_attribute(attribute='plugin_key')
         return plugin_key or DEFAULT_PLUGIN_KEY
+
+    def get_transport(self):
+        """
+        Return the transport between services, either amqp or in_process.
+
+        Services using the in_process transport exchange messages in
+        memory and have to run in the same process.
+
+        :rtype: string
+        """
+        transport = self._get_attribute(attribute='transport')
+        transport = transport or DEFAULT_TRANSPORT
+
+        if transport not in ('amqp', 'in_process'):
+            raise MQSFConfigException(
+                'transport must be amqp or in_process.'
+            )
+
+        return transport
+
+    def get_worker_processes(self):
+        """
+        Return the number of worker processes running the service.
+
+        With more than one the service runs under a supervisor and
+        each worker has its own job sub-directory.
+
+        :return: int
+        """
+        worker_processes = self._get_attribute(attribute='worker_processes')
+        return worker_processes or DEFAULT_WORKER_PROCESSES
+
+    def get_dedup_ttl(self):
+        """
+        Return the seconds completed job ids are remembered.
+
+        Listener messages for remembered job ids are dropped. If not
+        set completed jobs are not remembered.
+
+        :return: int
+        """
+        return self._get_attribute(attribute='dedup_ttl')
+
+    def get_dedup_max_size(self):
+        """
+        Return the max number of completed job ids remembered.
+
+        :return: int
+        """
+        dedup_max_size = self._get_attribute(attribute='dedup_max_size')
+        return dedup_max_size or DEFAULT_DEDUP_MAX_SIZE
+
+    def get_prefetch_count(self):
+        """
+        Return the number of unacknowledged messages the broker may push.
+
+        A value of 0, the default, disables the limit and lets the
+        broker deliver the whole queue backlog.
+
+        :return: int
+        """
+        prefetch_count = self._get_attribute(attribute='prefetch_count')
+        if prefetch_count is None:
+            return DEFAULT_PREFETCH_COUNT
+        return prefetch_count
+
+    def get_ack_batch_size(self):
+        """
+        Return the number of acknowledgements to coalesce into one.
+
+        :return: int
+        """
+        ack_batch_size = self._get_attribute(attribute='ack_batch_size')
+        return ack_batch_size or DEFAULT_ACK_BATCH_SIZE
+
+    def get_ack_batch_timeout(self):
+        """
+        Return the max seconds an acknowledgement may wait in a batch.
+
+        :return: float
+        """
+        ack_batch_timeout = self._get_attribute(
+            attribute='ack_batch_timeout'
+        )
+        if ack_batch_timeout is None:
+            return DEFAULT_ACK_BATCH_TIMEOUT
+        return ack_batch_timeout
+
+    def get_deferred_ack(self):
+        """
+        Return True if listener messages are acked after job completion.
+
+        :return: bool
+        """
+        deferred_ack = self._get_attribute(attribute='deferred_ack')
+        if deferred_ack is None:
+            return DEFAULT_DEFERRED_ACK
+        return deferred_ack
+
+    def get_max_unacked_jobs(self):
+        """
+        Return the max number of unacked jobs in flight for deferred acks.
+
+        :return: int
+        """
+        max_unacked_jobs = self._get_attribute(attribute='max_unacked_jobs')
+        return max_unacked_jobs or DEFAULT_MAX_UNACKED_JOBS
+
+    def get_publish_confirm_mode(self):
+        """
+        Return the publisher confirm mode, either sync or pipelined.
+
+        :rtype: string
+        """
+        publish_confirm_mode = self._get_attribute(
+            attribute='publish_confirm_mode'
+        )
+        publish_confirm_mode = (
+            publish_confirm_mode or DEFAULT_PUBLISH_CONFIRM_MODE
+        )
+
+        if publish_confirm_mode not in ('sync', 'pipelined'):
+            raise MQSFConfigException(
+                'publish_confirm_mode must be one of sync or pipelined.'
+            )
+
+        return publish_confirm_mode
+
+    def get_publish_confirm_window(self):
+        """
+        Return the max number of unconfirmed publishes per channel.
+
+        :return: int
+        """
+        publish_confirm_window = self._get_attribute(
+            attribute='publish_confirm_window'
+        )
+        return publish_confirm_window or DEFAULT_PUBLISH_CONFIRM_WINDOW
+
+    def get_publish_retry_count(self):
+        """
+        Return the number of times a failed publish is retried.
+
+        :return: int
+        """
+        publish_retry_count = self._get_attribute(
+            attribute='publish_retry_count'
+        )
+        if publish_retry_count is None:
+            return DEFAULT_PUBLISH_RETRY_COUNT
+        return publish_retry_count
+
+    def get_json_backend(self):
+        """
+        Return the json backend, None picks the fastest one installed.
+
+        :rtype: string
+        """
+        return self._get_attribute(attribute='json_backend')
+
+    def get_message_content_type(self):
+        """
+        Return the content type used to encode published messages.
+
+        :rtype: string
+        """
+        message_content_type = self._get_attribute(
+            attribute='message_content_type'
+        )
+        return message_content_type or DEFAULT_MESSAGE_CONTENT_TYPE
+
+    def get_job_store(self):
+        """
+        Return the job store backend, either file or journal.
+
+        :rtype: string
+        """
+        job_store = self._get_attribute(attribute='job_store')
+        return job_store or DEFAULT_JOB_STORE
+
+    def get_job_store_sync(self):
+        """
+        Return when job store writes are synced to disk.
+
+        One of none, always or group. Group is only supported by the
+        journal job store.
+
+        :rtype: string
+        """
+        job_store_sync = self._get_attribute(attribute='job_store_sync')
+        job_store_sync = job_store_sync or DEFAULT_JOB_STORE_SYNC
+
+        if job_store_sync not in ('none', 'always', 'group'):
+            raise MQSFConfigException(
+                'job_store_sync must be one of none, always or group.'
+            )
+
+        return job_store_sync
+
+    def get_journal_segment_size(self):
+        """
+        Return the size in bytes at which a journal segment rolls over.
+
+        :return: int
+        """
+        journal_segment_size = self._get_attribute(
+            attribute='journal_segment_size'
+        )
+        return journal_segment_size or DEFAULT_JOURNAL_SEGMENT_SIZE
+
+    def get_job_store_commit_window(self):
+        """
+        Return the seconds a group commit waits for more writes.
+
+        With no window writes arriving while a sync runs still share
+        the next sync, a single writer is never delayed.
+
+        :return: float
+        """
+        job_store_commit_window = self._get_attribute(
+            attribute='job_store_commit_window'
+        )
+        if job_store_commit_window is None:
+            return DEFAULT_JOB_STORE_COMMIT_WINDOW
+        return job_store_commit_window
+
+    def get_journal_compaction_interval(self):
+        """
+        Return the seconds between journal compaction runs.
+
+        :return: int
+        """
+        journal_compaction_interval = self._get_attribute(
+            attribute='journal_compaction_interval'
+        )
+        return (
+            journal_compaction_interval or DEFAULT_JOURNAL_COMPACTION_INTERVAL
+        )
+
+    def get_recovery_threads(self):
+        """
+        Return the number of threads decoding job files on restart.
+
+        :return: int
+        """
+        recovery_threads = self._get_attribute(attribute='recovery_threads')
+        return recovery_threads or DEFAULT_RECOVERY_THREADS
+
+    def get_executor_type(self):
+        """
+        Return the executor type jobs run in, either thread or process.
+
+        A mapping of plugin names to executor types selects the type
+        per plugin, plugins not in the mapping run in threads.
+
+        :return: string or dict
+        """
+        executor_type = self._get_attribute(attribute='executor_type')
+        executor_type = executor_type or DEFAULT_EXECUTOR_TYPE
+
+        if isinstance(executor_type, dict):
+            types = set(executor_type.values())
+        else:
+            types = {executor_type}
+
+        if not types.issubset({'thread', 'process'}):
+            raise MQSFConfigException(
+                'executor_type must be thread, process or a mapping '
+                'of plugin names to these types.'
+            )
+
+        return executor_type
+
+    def get_async_max_concurrency(self):
+        """
+        Return the max number of jobs running at once in an async service.
+
+        :return: int
+        """
+        async_max_concurrency = self._get_attribute(
+            attribute='async_max_concurrency'
+        )
+        return async_max_concurrency or DEFAULT_ASYNC_MAX_CONCURRENCY
+
+    def get_executors(self):
+        """
+        Return the named executors with their settings.
+
+        Each executor may set type (thread or process), workers and
+        max_queued, the max number of jobs waiting for a worker.
+
+        :return: dict
+        """
+        executors = self._get_attribute(attribute='executors') or {}
+
+        for name, executor in executors.items():
+            executor = executor or {}
+            executors[name] = executor
+
+            if executor.get('type', 'thread') not in ('thread', 'process'):
+                raise MQSFConfigException(
+                    'Type of executor {0} must be thread or process.'.format(
+                        name
+                    )
+                )
+
+        return executors
+
+    def get_plugin_executors(self):
+        """
+        Return the mapping of plugin names to named executors.
+
+        :return: dict
+        """
+        return self._get_attribute(attribute='plugin_executors') or {}
+
+    def get_max_priority(self):
+        """
+        Return the max priority of the listener queue.
+
+        If set the queue is declared as priority queue. The arguments
+        of an existing queue cannot change, the queue has to be deleted
+        before enabling or changing the max priority.
+
+        :return: int
+        """
+        return self._get_attribute(attribute='max_priority')
+
+    def get_priority_field(self):
+        """
+        Return the message field holding the job priority.
+
+        If not set the priority property of the message is used.
+
+        :rtype: string
+        """
+        return self._get_attribute(attribute='priority_field')
+
+    def get_batch_size(self):
+        """
+        Return the max number of jobs passed to a run_tasks plugin at once.
+
+        :return: int
+        """
+        batch_size = self._get_attribute(attribute='batch_size')
+        return batch_size or DEFAULT_BATCH_SIZE
+
+    def get_batch_window(self):
+        """
+        Return the max seconds a job waits for its batch to fill up.
+
+        :return: float
+        """
+        batch_window = self._get_attribute(attribute='batch_window')
+        if batch_window is None:
+            return DEFAULT_BATCH_WINDOW
+        return batch_window
@@ -0,0 +1,161 @@
+# Copyright (c) 2023 SUSE LLC.  All rights reserved.
+#
+# This file is part of mqsf.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+
+from amqpstorm import Connection
+
+from mqsf.exceptions import MQConnectionException
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+class ConnectionManager(object):
+    """
+    Shared AMQP connection handing out channels to its users.
+
+    Users acquire the manager when they start using the connection
+    and release it when done, the connection is closed once the
+    last user released it.
+
+    Attributes
+
+    * :attr:`host`
+      MQ server host
+
+    * :attr:`users`
+      Number of users holding the manager
+
+    * :attr:`codec`
+      Codec messages on the transport are encoded with, None to use
+      the codec configured for the service
+    """
+    codec = None
+
+    def __init__(
+        self, host, username, password, port, virtual_host, heartbeat
+    ):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.port = port
+        self.virtual_host = virtual_host
+        self.heartbeat = heartbeat
+        self.connection = None
+        self.users = 0
+        self.lock = threading.RLock()
+
+    def acquire(self):
+        """
+        Register a user of the connection.
+        """
+        with self.lock:
+            self.users += 1
+
+        return self
+
+    def release(self):
+        """
+        Unregister a user and close the connection if it was the last.
+        """
+        with self.lock:
+            self.users = max(self.users - 1, 0)
+
+            if not self.users:
+                self.close()
+
+    def get_connection(self):
+        """
+        Return the connection, open it if currently closed or None.
+
+        Raises: MQConnectionException if connection
+                cannot be established.
+        """
+        with self.lock:
+            if not self.connection or self.connection.is_closed:
+                try:
+                    self.connection = Connection(
+                        self.host,
+                        self.username,
+                        self.password,
+                        self.port,
+                        virtual_host=self.virtual_host,
+                        heartbeat=self.heartbeat
+                    )
+                except Exception as e:
+                    raise MQConnectionException(
+                        'Connection to MQ server failed: {0}'.format(e)
+                    )
+
+            return self.connection
+
+    def channel(self):
+        """
+        Open a new channel on the connection.
+        """
+        return self.get_connection().channel()
+
+    def close(self):
+        """
+        Close the connection if open.
+        """
+        with self.lock:
+            if self.connection and self.connection.is_open:
+                self.connection.close()
+
+            self.connection = None
+
+
+def get_connection_manager(
+    host, username, password, port, virtual_host='/', heartbeat=600
+):
+    """
+    Return the process wide connection manager for the settings.
+
+    Components using the same settings share one connection. The
+    manager is acquired for the caller and has to be released.
+    """
+    key = (host, username, password, port, virtual_host, heartbeat)
+
+    with _managers_lock:
+        manager = _managers.get(key)
+
+        if not manager:
+            manager = ConnectionManager(*key)
+            _managers[key] = manager
+
+        return manager.acquire()
+
+
+def _reset_managers():
+    """
+    Forget the managers of the parent process in a forked child.
+
+    The connection socket belongs to the parent, children open
+    their own connection.
+    """
+    global _managers_lock
+
+    _managers.clear()
+    _managers_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_managers)
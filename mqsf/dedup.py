@@ -0,0 +1,274 @@
+# Copyright (c) 2023 SUSE LLC.  All rights reserved.
+#
+# This file is part of mqsf.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from tempfile import mkstemp
+
+from mqsf.utils import DEDUP_INDEX, remove_file
+
+logger = logging.getLogger('DedupIndex')
+
+
+class DedupIndex(object):
+    """
+    Index of recently completed job ids.
+
+    Ids expire after ttl seconds and the oldest ids are evicted once
+    max_size ids are indexed. Ids are kept as 64 bit digests.
+
+    The index file is shared by the worker processes of a service.
+    Added ids are appended under a lock on the lock file and ids added
+    by other processes are read from the file before a lookup misses.
+    The file is compacted once it holds twice the live ids. The file
+    is not synced, ids added right before a crash may be lost.
+
+    Attributes
+
+    * :attr:`path`
+      Index file
+
+    * :attr:`ttl`
+      Seconds an id stays in the index
+
+    * :attr:`max_size`
+      Max number of ids in the index
+    """
+    def __init__(self, path, ttl, max_size):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.records = 0
+        self.index_fd = None
+        self.inode = None
+        self.offset = 0
+        self.lock_fd = os.open(
+            '{0}.lock'.format(path),
+            os.O_RDWR | os.O_CREAT,
+            0o644
+        )
+
+        self.compact()
+
+    @staticmethod
+    def get_digest(job_id):
+        return int.from_bytes(
+            hashlib.blake2b(job_id.encode('utf-8'), digest_size=8).digest(),
+            'big'
+        )
+
+    @contextmanager
+    def _locked(self):
+        """
+        Hold the thread lock and the lock shared with other processes.
+        """
+        with self.lock:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+
+    def _open(self):
+        """
+        Open the index file and read it from the start.
+        """
+        if self.index_fd is not None:
+            os.close(self.index_fd)
+
+        self.index_fd = os.open(
+            self.path,
+            os.O_RDWR | os.O_APPEND | os.O_CREAT,
+            0o644
+        )
+        self.inode = os.fstat(self.index_fd).st_ino
+        self.entries.clear()
+        self.records = 0
+        self.offset = 0
+
+    def _refresh(self):
+        """
+        Read the ids appended to the index file since the last read.
+
+        The index file is reopened once it was replaced by a compaction
+        of another process. Torn records are skipped.
+        """
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            inode = None
+
+        if self.index_fd is None or inode != self.inode:
+            self._open()
+
+        size = os.fstat(self.index_fd).st_size
+        if size <= self.offset:
+            return
+
+        data = os.pread(self.index_fd, size - self.offset, self.offset)
+        # A record still being written is read on the next refresh
+        data = data[:data.rfind(b'\n') + 1]
+        self.offset += len(data)
+        now = time.time()
+
+        for line in data.decode('utf-8', 'replace').splitlines():
+            self.records += 1
+
+            try:
+                digest, expires = line.split()
+                digest = int(digest, 16)
+                expires = float(expires)
+            except ValueError:
+                continue
+
+            if expires > now:
+                self.entries.pop(digest, None)
+                self.entries[digest] = expires
+
+        self._expire(now)
+
+    def _expire(self, now):
+        """
+        Remove expired ids and evict the oldest over max size.
+
+        Ids are added with the same ttl, the oldest expire first.
+        """
+        while self.entries:
+            digest, expires = next(iter(self.entries.items()))
+
+            if expires > now and len(self.entries) <= self.max_size:
+                break
+
+            self.entries.popitem(last=False)
+
+    def add(self, job_id):
+        """
+        Add the id of a completed job to the index.
+        """
+        digest = self.get_digest(job_id)
+
+        with self._locked():
+            self._refresh()
+
+            now = time.time()
+            expires = now + self.ttl
+            self.entries.pop(digest, None)
+            self.entries[digest] = expires
+            self._expire(now)
+
+            record = '{0:016x} {1:.3f}\n'.format(digest, expires)
+            self.offset += os.write(self.index_fd, record.encode('utf-8'))
+            self.records += 1
+
+            if self.records > 2 * len(self.entries) + 1000:
+                self._compact()
+
+    def __contains__(self, job_id):
+        digest = self.get_digest(job_id)
+
+        # A single dict lookup, ids of other processes are read on a miss
+        expires = self.entries.get(digest)
+        if expires is None:
+            with self.lock:
+                self._refresh()
+
+            expires = self.entries.get(digest)
+
+        return expires is not None and expires > time.time()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def compact(self):
+        """
+        Rewrite the index file with the live ids.
+        """
+        with self._locked():
+            self._compact()
+
+    def _compact(self):
+        self._refresh()
+
+        data = ''.join(
+            '{0:016x} {1:.3f}\n'.format(digest, expires)
+            for digest, expires in self.entries.items()
+        ).encode('utf-8')
+
+        directory, name = os.path.split(self.path)
+        fd, temp_path = mkstemp(
+            dir=directory or '.',
+            prefix='.{0}.'.format(name),
+            suffix='.tmp'
+        )
+
+        try:
+            with os.fdopen(fd, 'wb') as index_file:
+                index_file.write(data)
+
+            os.replace(temp_path, self.path)
+        except BaseException:
+            remove_file(temp_path)
+            raise
+
+        # Keep the entries, the new file holds exactly the live ids
+        os.close(self.index_fd)
+        self.index_fd = os.open(self.path, os.O_RDWR | os.O_APPEND)
+        self.inode = os.fstat(self.index_fd).st_ino
+        self.offset = len(data)
+        self.records = len(self.entries)
+
+    def close(self):
+        """
+        Close the index and lock files.
+        """
+        with self.lock:
+            if self.index_fd is not None:
+                os.close(self.index_fd)
+                self.index_fd = None
+
+            if self.lock_fd is not None:
+                os.close(self.lock_fd)
+                self.lock_fd = None
+
+
+def get_dedup_index(config, job_directory):
+    """
+    Return the dedup index of the service, None if disabled.
+
+    The index is kept in the job directory of the service, not in the
+    directory of a worker, so all workers share it.
+    """
+    ttl = config.get_dedup_ttl()
+
+    if not ttl:
+        return None
+
+    return DedupIndex(
+        os.path.join(job_directory, DEDUP_INDEX),
+        ttl,
+        config.get_dedup_max_size()
+    )
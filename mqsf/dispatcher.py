@@ -0,0 +1,294 @@
+# Copyright (c) 2023 SUSE LLC.  All rights reserved.
+#
+# This file is part of mqsf.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+
+import heapq
+import itertools
+import threading
+import time
+
+from collections import deque
+
+RUN = 'run'
+QUEUED = 'queued'
+REJECTED = 'rejected'
+
+
+class Lane(object):
+    """
+    Concurrency limits and waiting jobs of one executor.
+
+    Waiting jobs are kept in a heap ordered by descending priority
+    and arrival order within the same priority.
+    """
+    def __init__(self, name, workers, max_queued=None):
+        self.name = name
+        self.workers = workers
+        self.max_queued = max_queued
+        self.running = 0
+        self.waiting = []
+        self.counter = itertools.count()
+
+    def push(self, job_id, priority):
+        heapq.heappush(
+            self.waiting,
+            (-priority, next(self.counter), job_id)
+        )
+
+    def pop(self):
+        return heapq.heappop(self.waiting)[2]
+
+    @property
+    def is_full(self):
+        if self.max_queued is None:
+            return False
+
+        return len(self.waiting) >= self.max_queued
+
+
+class JobDispatcher(object):
+    """
+    Dispatch jobs to executor lanes with independent limits.
+
+    Each lane runs at most workers jobs at a time, further jobs wait
+    in the lane until a running job is released and are started in
+    order of priority. A lane with
+    max_queued set rejects jobs once that many are waiting, so a
+    backed up lane never delays jobs of the other lanes.
+
+    With a worker budget a job also needs a slot of the budget to
+    start. Released slots go back to the budget, which offers them
+    to all dispatchers sharing it.
+    """
+    def __init__(self, budget=None):
+        self.lock = threading.Lock()
+        self.lanes = {}
+        self.running = {}
+        self.budget = budget
+
+    def add_lane(self, name, workers, max_queued=None):
+        lane = Lane(name, workers, max_queued)
+        self.lanes[name] = lane
+        return lane
+
+    def is_full(self, name):
+        """
+        Return True if the lane does not accept more waiting jobs.
+        """
+        with self.lock:
+            lane = self.lanes[name]
+            return lane.running >= lane.workers and lane.is_full
+
+    def submit(self, name, job_id, priority=0, force=False):
+        """
+        Submit the job with the given priority to the lane.
+
+        Return RUN if the job can start now, QUEUED if it waits for a
+        free worker and REJECTED if the lane is full. With force the
+        job is queued even if the lane is full.
+        """
+        with self.lock:
+            lane = self.lanes[name]
+
+            if lane.running < lane.workers and self._acquire_budget():
+                lane.running += 1
+                self.running[job_id] = lane
+                return RUN
+
+            if lane.is_full and not force:
+                return REJECTED
+
+            lane.push(job_id, priority)
+            return QUEUED
+
+    def release(self, job_id):
+        """
+        Release the worker held by the job.
+
+        Return the id of the highest priority waiting job in the lane,
+        which now holds the worker, or None.
+        """
+        with self.lock:
+            lane = self.running.pop(job_id, None)
+
+            if not lane:
+                return None
+
+            if lane.waiting and not self.budget:
+                next_job_id = lane.pop()
+                self.running[next_job_id] = lane
+                return next_job_id
+
+            lane.running -= 1
+
+            if self.budget:
+                self.budget.release()
+
+            return None
+
+    def next_job(self):
+        """
+        Start the highest priority waiting job that can run now.
+
+        Return the job id, which now holds a worker of its lane, or
+        None if no waiting job can start.
+        """
+        with self.lock:
+            lanes = [
+                lane for lane in self.lanes.values()
+                if lane.waiting and lane.running < lane.workers
+            ]
+
+            if not lanes or not self._acquire_budget():
+                return None
+
+            # Heap entries compare by priority, then arrival
+            lane = min(lanes, key=lambda lane: lane.waiting[0])
+            job_id = lane.pop()
+            lane.running += 1
+            self.running[job_id] = lane
+            return job_id
+
+    def _acquire_budget(self):
+        """
+        Take a slot of the worker budget, True if there is no budget.
+        """
+        return self.budget is None or self.budget.acquire()
+
+    def stats(self):
+        """
+        Return the running and waiting job counts per lane.
+        """
+        with self.lock:
+            return {
+                name: {
+                    'running': lane.running,
+                    'waiting': len(lane.waiting)
+                } for name, lane in self.lanes.items()
+            }
+
+
+class WorkerBudget(object):
+    """
+    Limit of jobs running at once across the dispatchers sharing it.
+
+    Listeners are called when slots are free, each in turn so the
+    waiting jobs of all dispatchers get a share of the slots.
+
+    Attributes
+
+    * :attr:`workers`
+      Number of jobs running at once
+
+    * :attr:`running`
+      Number of slots taken
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self.running = 0
+        self.lock = threading.Lock()
+        self.listeners = deque()
+
+    def acquire(self):
+        """
+        Take a slot, return False if all slots are taken.
+        """
+        with self.lock:
+            if self.running >= self.workers:
+                return False
+
+            self.running += 1
+            return True
+
+    def release(self):
+        """
+        Return a slot.
+        """
+        with self.lock:
+            self.running -= 1
+
+    def add_listener(self, callback):
+        """
+        Add the callback starting waiting jobs when slots are free.
+        """
+        with self.lock:
+            self.listeners.append(callback)
+
+    def notify(self):
+        """
+        Call the listeners in turn while slots are free.
+        """
+        with self.lock:
+            count = len(self.listeners)
+
+        for _ in range(count):
+            with self.lock:
+                if self.running >= self.workers:
+                    return
+
+                # Start with the listener after the one called last
+                self.listeners.rotate(-1)
+                listener = self.listeners[-1]
+
+            listener()
+
+
+class JobBatcher(object):
+    """
+    Collect jobs into batches per key, e.g. the plugin name.
+
+    A batch is complete once it holds size jobs or its first job has
+    waited window seconds.
+    """
+    def __init__(self, size, window):
+        self.size = size
+        self.window = window
+        self.lock = threading.Lock()
+        self.batches = {}
+
+    def add(self, key, job_id):
+        """
+        Add the job to the batch for key.
+
+        Return the job ids of the batch if it is complete, else None.
+        """
+        with self.lock:
+            started, job_ids = self.batches.setdefault(
+                key,
+                (time.monotonic(), [])
+            )
+            job_ids.append(job_id)
+
+            if len(job_ids) >= self.size:
+                del self.batches[key]
+                return job_ids
+
+        return None
+
+    def due(self):
+        """
+        Remove and return the job ids of all batches past the window.
+        """
+        now = time.monotonic()
+
+        with self.lock:
+            keys = [
+                key for key, (started, job_ids) in self.batches.items()
+                if now - started >= self.window
+            ]
+
+            return [self.batches.pop(key)[1] for key in keys]
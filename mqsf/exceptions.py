@@ -77,3 +77,9 @@ class MessageServiceException(MQSFException):
     """
     Exception raised if an error occurs in message service.
     """
+
+
+class MQSFCodecException(MQSFException):
+    """
+    Exception raised if a message cannot be encoded or decoded.
+    """
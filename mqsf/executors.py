@@ -0,0 +1,81 @@
+# Copyright (c) 2023 SUSE LLC.  All rights reserved.
+#
+# This file is part of mqsf.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+
+import logging
+import multiprocessing
+import signal
+
+from apscheduler.executors.pool import ProcessPoolExecutor, ThreadPoolExecutor
+
+from mqsf import plugin_manager
+from mqsf.job_factory import BaseJobFactory
+
+
+def create_executor(executor_type, workers):
+    """
+    Return a scheduler executor of the given type.
+
+    Worker processes are forked so they inherit the plugins
+    registered in the service process.
+    """
+    if executor_type == 'process':
+        return ProcessPoolExecutor(
+            workers,
+            pool_kwargs={
+                'mp_context': multiprocessing.get_context('fork'),
+                'initializer': reset_worker_signals
+            }
+        )
+
+    return ThreadPoolExecutor(workers)
+
+
+def reset_worker_signals():
+    """
+    Reset the signal handlers inherited from the service process.
+
+    Workers are started lazily, after the service pointed SIGINT and
+    SIGTERM at its stop method. A worker must not stop the connection,
+    scheduler and job store of the service, Ctrl-C is left to the
+    service and SIGTERM terminates the worker.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def run_job_in_process(service_name, plugin_key, can_skip, job_config):
+    """
+    Run the job in a worker process and return the job config.
+
+    The job config is sent to the worker and the config as mutated by
+    the plugin is sent back as the job return value. Plugin logs go
+    to a worker logger as the service log handlers are not usable
+    from a forked process.
+    """
+    job_factory = BaseJobFactory(
+        service_name=service_name,
+        plugin_manager=plugin_manager,
+        plugin_key=plugin_key,
+        can_skip=can_skip
+    )
+    log = logging.getLogger(
+        '{0}ServiceWorker'.format(service_name.title())
+    )
+
+    job_factory.run_job(job_config, log)
+    return job_config
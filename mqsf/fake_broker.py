@@ -0,0 +1,535 @@
+# Copyright (c) 2023 SUSE LLC.  All rights reserved.
+#
+# This file is part of mqsf.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+
+import copy
+import heapq
+import itertools
+import threading
+
+from queue import Queue
+
+from amqpstorm import AMQPChannelError, AMQPConnectionError
+
+try:
+    from pamqp import commands
+except ImportError:  # pamqp < 3
+    from pamqp import specification as commands
+
+from mqsf.connection import ConnectionManager
+
+IDLE_WAIT = 0.01
+MAX_DELIVERIES = 1000
+
+
+class FakeBroker(object):
+    """
+    In-memory stand-in for the MQ broker.
+
+    Implements the exchange, queue, bind, publish, consume and ack
+    operations used by the services so they can run without a
+    broker. It backs the in-process transport and is used by the
+    pipeline benchmark. Messages are not persisted.
+
+    Attributes
+
+    * :attr:`exchanges`
+      Exchange types by exchange name
+
+    * :attr:`queues`
+      Queues by queue name
+
+    * :attr:`bindings`
+      Routing keys and queue names bound per exchange
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.exchanges = {}
+        self.queues = {}
+        self.bindings = {}
+
+    def declare_exchange(self, exchange, exchange_type='direct'):
+        with self.condition:
+            self.exchanges.setdefault(exchange, exchange_type)
+            self.bindings.setdefault(exchange, [])
+
+    def declare_queue(self, queue, arguments=None):
+        with self.condition:
+            if queue not in self.queues:
+                self.queues[queue] = FakeQueue(
+                    queue,
+                    (arguments or {}).get('x-max-priority')
+                )
+
+            return {'queue': queue, 'message_count': len(self.queues[queue])}
+
+    def bind(self, queue, exchange, routing_key):
+        with self.condition:
+            binding = (routing_key, queue)
+
+            if binding not in self.bindings[exchange]:
+                self.bindings[exchange].append(binding)
+
+    def unbind(self, queue, exchange, routing_key):
+        with self.condition:
+            binding = (routing_key, queue)
+
+            if binding in self.bindings.get(exchange, []):
+                self.bindings[exchange].remove(binding)
+
+    def publish(self, body, routing_key, exchange, properties):
+        """
+        Route the message to the bound queues.
+
+        Return True if the message was routed to at least one queue.
+        """
+        with self.condition:
+            if exchange:
+                exchange_type = self.exchanges[exchange]
+                queues = [
+                    queue for key, queue in self.bindings[exchange]
+                    if exchange_type == 'fanout' or
+                    match_routing_key(exchange_type, key, routing_key)
+                ]
+            else:
+                # Default exchange routes by queue name
+                queues = [routing_key] if routing_key in self.queues else []
+
+            for index, queue in enumerate(queues):
+                if index:
+                    # In-process bodies are dicts mutated by the
+                    # receiving service, every queue gets its own
+                    body = copy.deepcopy(body)
+
+                self.queues[queue].push(
+                    body,
+                    routing_key,
+                    exchange,
+                    dict(properties)
+                )
+
+            if queues:
+                self.condition.notify_all()
+
+            return bool(queues)
+
+
+class FakeQueue(object):
+    """
+    Queue of messages, a priority queue if max priority is set.
+    """
+    def __init__(self, name, max_priority=None):
+        self.name = name
+        self.max_priority = max_priority
+        self.messages = []
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.messages)
+
+    def push(self, body, routing_key, exchange, properties, redelivered=False):
+        priority = 0
+        if self.max_priority:
+            priority = min(properties.get('priority') or 0, self.max_priority)
+
+        heapq.heappush(self.messages, (
+            -priority,
+            next(self.counter),
+            (body, routing_key, exchange, properties, redelivered)
+        ))
+
+    def pop(self):
+        return heapq.heappop(self.messages)[2]
+
+
+class FakeConnectionManager(ConnectionManager):
+    """
+    Connection manager handing out connections to a fake broker.
+    """
+    def __init__(self, broker):
+        super(FakeConnectionManager, self).__init__(
+            'fake', None, None, None, '/', 0
+        )
+        self.broker = broker
+
+    def get_connection(self):
+        with self.lock:
+            if not self.connection or self.connection.is_closed:
+                self.connection = FakeConnection(self.broker)
+
+            return self.connection
+
+
+class FakeConnection(object):
+    """
+    Connection to a fake broker.
+    """
+    def __init__(self, broker):
+        self.broker = broker
+        self.channels = []
+        self.is_open = True
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    def channel(self):
+        if not self.is_open:
+            raise AMQPConnectionError('Connection was closed')
+
+        channel = FakeChannel(self.broker)
+        self.channels.append(channel)
+        return channel
+
+    def close(self):
+        for channel in self.channels:
+            channel.close()
+
+        self.is_open = False
+
+
+class FakeChannel(object):
+    """
+    Channel to a fake broker.
+
+    Deliveries for the consumers of the channel are taken from the
+    queues in process_data_events, limited by the prefetch count.
+
+    Once Confirm.Select is requested publishes are confirmed with
+    Basic.Ack frames, preceded by a Basic.Return for unroutable
+    mandatory messages. The frames are passed to on_frame by a frame
+    thread, as the io thread of a connection does.
+    """
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+        self.confirm = False
+        self.frames = None
+        self.publish_tags = None
+        self.prefetch_count = 0
+        self.consumers = {}
+        self.unacked = {}
+        self.delivery_tags = itertools.count(1)
+        self.consumer_ids = itertools.count(1)
+
+        self.basic = FakeBasic(self)
+        self.exchange = FakeExchange(self)
+        self.queue = FakeQueueOperations(self)
+
+    @property
+    def is_closed(self):
+        return not self.is_open
+
+    @property
+    def consumer_tags(self):
+        return list(self.consumers)
+
+    def check_open(self):
+        if not self.is_open:
+            raise AMQPChannelError('Channel was closed')
+
+    def confirm_deliveries(self):
+        self.confirm = True
+
+    def on_frame(self, frame_in):
+        """
+        Handle a frame from the broker, unhandled frames are dropped.
+        """
+
+    def rpc_request(self, frame_out):
+        """
+        Send a method frame, only Confirm.Select is supported.
+        """
+        self.check_open()
+
+        if frame_out.name != 'Confirm.Select':
+            raise AMQPChannelError(
+                'Method {0} is not supported'.format(frame_out.name)
+            )
+
+        if self.frames is None:
+            self.publish_tags = itertools.count(1)
+            self.frames = Queue()
+            threading.Thread(
+                target=self._deliver_frames,
+                name='fake-frames',
+                daemon=True
+            ).start()
+
+    def confirm_publish(self, routed, mandatory, exchange, routing_key):
+        """
+        Queue the confirm frames of a publish.
+        """
+        delivery_tag = next(self.publish_tags)
+
+        if mandatory and not routed:
+            self.frames.put(commands.Basic.Return(
+                reply_code=312,
+                reply_text='NO_ROUTE',
+                exchange=exchange,
+                routing_key=routing_key
+            ))
+
+        self.frames.put(commands.Basic.Ack(delivery_tag=delivery_tag))
+
+    def _deliver_frames(self):
+        """
+        Pass the queued frames to on_frame until the channel closes.
+        """
+        while True:
+            frame_in = self.frames.get()
+
+            if frame_in is None:
+                return
+
+            self.on_frame(frame_in)
+
+    def process_data_events(self, auto_decode=False):
+        """
+        Deliver available messages to the consumer callbacks.
+
+        Wait a short time for messages if none are available.
+        """
+        with self.broker.condition:
+            deliveries = self._take_deliveries()
+
+            if not deliveries and self.is_open:
+                self.broker.condition.wait(IDLE_WAIT)
+                deliveries = self._take_deliveries()
+
+        for callback, message in deliveries:
+            callback(message)
+
+    def _take_deliveries(self):
+        """
+        Remove messages from the consumed queues up to the prefetch count.
+        """
+        deliveries = []
+
+        for callback, queue in list(self.consumers.values()):
+            queue = self.broker.queues[queue]
+
+            while queue and len(deliveries) < MAX_DELIVERIES:
+                if self.prefetch_count and \
+                        len(self.unacked) >= self.prefetch_count:
+                    return deliveries
+
+                body, routing_key, exchange, properties, redelivered = \
+                    queue.pop()
+                delivery_tag = next(self.delivery_tags)
+                self.unacked[delivery_tag] = (
+                    queue, body, routing_key, exchange, properties
+                )
+                deliveries.append((callback, FakeMessage(
+                    self,
+                    body,
+                    properties,
+                    {
+                        'delivery_tag': delivery_tag,
+                        'routing_key': routing_key,
+                        'exchange': exchange,
+                        'redelivered': redelivered
+                    }
+                )))
+
+        return deliveries
+
+    def ack(self, delivery_tag, multiple=False):
+        with self.broker.condition:
+            if multiple:
+                tags = [tag for tag in self.unacked if tag <= delivery_tag]
+            else:
+                tags = [delivery_tag]
+
+            for tag in tags:
+                self.unacked.pop(tag, None)
+
+            self.broker.condition.notify_all()
+
+    def nack(self, delivery_tag, requeue=True):
+        with self.broker.condition:
+            delivery = self.unacked.pop(delivery_tag, None)
+
+            if delivery and requeue:
+                queue, body, routing_key, exchange, properties = delivery
+                queue.push(body, routing_key, exchange, properties, True)
+
+            self.broker.condition.notify_all()
+
+    def stop_consuming(self):
+        with self.broker.condition:
+            self.consumers.clear()
+
+    def close(self):
+        """
+        Close the channel and requeue unacknowledged messages.
+        """
+        with self.broker.condition:
+            for delivery_tag in list(self.unacked):
+                self.nack(delivery_tag)
+
+            self.consumers.clear()
+            self.is_open = False
+            self.broker.condition.notify_all()
+
+        if self.frames is not None:
+            self.frames.put(None)
+
+
+class FakeBasic(object):
+    """
+    Basic operations of a fake channel.
+    """
+    def __init__(self, channel):
+        self.channel = channel
+
+    def qos(self, prefetch_count=0, prefetch_size=0, global_=False):
+        self.channel.prefetch_count = prefetch_count
+
+    def consume(self, callback=None, queue='', consumer_tag='', **kwargs):
+        self.channel.check_open()
+
+        with self.channel.broker.condition:
+            consumer_tag = consumer_tag or 'consumer-{0}'.format(
+                next(self.channel.consumer_ids)
+            )
+            self.channel.consumers[consumer_tag] = (callback, queue)
+
+        return consumer_tag
+
+    def publish(
+        self, body, routing_key, exchange='', properties=None,
+        mandatory=False, immediate=False
+    ):
+        """
+        Publish the message, return the confirm in confirm mode.
+        """
+        self.channel.check_open()
+
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+
+        routed = self.channel.broker.publish(
+            body,
+            routing_key,
+            exchange,
+            properties or {}
+        )
+
+        if self.channel.frames is not None:
+            self.channel.confirm_publish(
+                routed,
+                mandatory,
+                exchange,
+                routing_key
+            )
+        elif self.channel.confirm:
+            return routed or not mandatory
+
+    def ack(self, delivery_tag=0, multiple=False):
+        self.channel.ack(delivery_tag, multiple)
+
+    def nack(self, delivery_tag=0, multiple=False, requeue=True):
+        self.channel.nack(delivery_tag, requeue)
+
+
+class FakeExchange(object):
+    """
+    Exchange operations of a fake channel.
+    """
+    def __init__(self, channel):
+        self.channel = channel
+
+    def declare(self, exchange='', exchange_type='direct', **kwargs):
+        self.channel.check_open()
+        self.channel.broker.declare_exchange(exchange, exchange_type)
+
+
+class FakeQueueOperations(object):
+    """
+    Queue operations of a fake channel.
+    """
+    def __init__(self, channel):
+        self.channel = channel
+
+    def declare(self, queue='', arguments=None, **kwargs):
+        self.channel.check_open()
+        return self.channel.broker.declare_queue(queue, arguments)
+
+    def bind(self, queue='', exchange='', routing_key='', **kwargs):
+        self.channel.check_open()
+        self.channel.broker.bind(queue, exchange, routing_key)
+
+    def unbind(self, queue='', exchange='', routing_key='', **kwargs):
+        self.channel.check_open()
+        self.channel.broker.unbind(queue, exchange, routing_key)
+
+
+class FakeMessage(object):
+    """
+    Message delivered by a fake channel.
+    """
+    def __init__(self, channel, body, properties, method):
+        self.channel = channel
+        self.body = body
+        self.properties = properties
+        self.method = method
+
+    @property
+    def delivery_tag(self):
+        return self.method['delivery_tag']
+
+    def ack(self):
+        self.channel.ack(self.delivery_tag)
+
+    def nack(self, requeue=True):
+        self.channel.nack(self.delivery_tag, requeue)
+
+    def reject(self, requeue=True):
+        self.channel.nack(self.delivery_tag, requeue)
+
+
+def match_routing_key(exchange_type, binding_key, routing_key):
+    """
+    Return True if the routing key matches the binding key.
+
+    Topic binding keys match words separated by dots, * matches one
+    word and # zero or more words.
+    """
+    if exchange_type != 'topic':
+        return binding_key == routing_key
+
+    return _match_words(binding_key.split('.'), routing_key.split('.'))
+
+
+def _match_words(pattern, words):
+    if not pattern:
+        return not words
+
+    if pattern[0] == '#':
+        return any(
+            _match_words(pattern[1:], words[index:])
+            for index in range(len(words) + 1)
+        )
+
+    if not words:
+        return False
+
+    if pattern[0] in ('*', words[0]):
+        return _match_words(pattern[1:], words[1:])
+
+    return False
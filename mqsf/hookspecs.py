@@ -26,3 +26,33 @@ class MQSFSpec(object):
     @hookspec
     def run_task(self, data, log_callback):
         """Run the workload"""
+
+    @hookspec
+    def run_tasks(self, batch, log_callback):
+        """Run the workload for a list of jobs of the same plugin"""
+
+    @hookspec
+    async def run_task_async(self, data, log_callback):
+        """Run the workload as a coroutine in AsyncMessageService"""
+
+    # Lifecycle hooks, timestamps are from time.monotonic()
+
+    @hookspec
+    def mqsf_message_received(self, service, job_id, timestamp, metadata):
+        """Listener message for the job was received"""
+
+    @hookspec
+    def mqsf_job_scheduled(self, service, job_id, timestamp, metadata):
+        """Job was dispatched to its executor"""
+
+    @hookspec
+    def mqsf_job_started(self, service, job_id, timestamp, metadata):
+        """Plugin task of the job started"""
+
+    @hookspec
+    def mqsf_job_finished(self, service, job_id, timestamp, metadata):
+        """Job finished with the status in metadata"""
+
+    @hookspec
+    def mqsf_message_published(self, service, job_id, timestamp, metadata):
+        """Status message of the job was published to the next service"""
@@ -17,6 +17,7 @@
 # -*- coding: utf-8 -*-
 
 from mqsf.exceptions import MQSFJobException
+from mqsf.status_levels import EXCEPTION
 
 
 class BaseJobFactory(object):
@@ -35,8 +36,12 @@ class BaseJobFactory(object):
         """
         Create new instance of job based on type,
         """
-        plugin_name = job_config.get(self.plugin_key)
+        return self.get_plugin(job_config.get(self.plugin_key))
 
+    def get_plugin(self, plugin_name):
+        """
+        Return the plugin registered for the plugin name.
+        """
         if not plugin_name:
             raise MQSFJobException(
                 'No plugin type provided, cannot create job'
@@ -56,3 +61,22 @@ class BaseJobFactory(object):
             job_plugin = self.plugin_manager.get_plugin(name='NoOpJob')
 
         return job_plugin
+
+    def run_job(self, job_config, log, service=None):
+        """
+        Create the job plugin and run the task on the job config.
+
+        The plugin task is called with service as its first argument.
+        Jobs run in a worker process get None as there is no service
+        instance in the worker.
+        """
+        try:
+            plugin = self.create_job(job_config)
+        except Exception as error:
+            log.error(
+                'Invalid job: {0}.'.format(error)
+            )
+            job_config['status'] = EXCEPTION
+            job_config.get('errors', []).append(error)
+        else:
+            plugin.run_task(service, job_config, log)
@@ -0,0 +1,520 @@
+# Copyright (c) 2023 SUSE LLC.  All rights reserved.
+#
+# This file is part of mqsf.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import threading
+import time
+
+from mqsf.exceptions import MQSFConfigException
+from mqsf.json_format import JsonFormat
+from mqsf.utils import (
+    SEGMENT_TEMPLATE,
+    GroupCommit,
+    get_journal_segments,
+    load_json,
+    persist_json,
+    remove_file,
+    restart_jobs
+)
+
+logger = logging.getLogger('JobStore')
+
+
+class JobRecord(object):
+    """
+    In-memory record of a queued job.
+
+    The job config stays in the job store and is only loaded once the
+    job starts, so the memory per queued job does not depend on the
+    size of the job config.
+
+    Attributes
+
+    * :attr:`id`
+      Job id
+
+    * :attr:`status`
+      Status of the listener message
+
+    * :attr:`plugin`
+      Name of the plugin running the job
+
+    * :attr:`routing_key`
+      Routing key of the listener message
+    """
+    __slots__ = ('id', 'status', 'plugin', 'routing_key')
+
+    def __init__(self, job_id, status, plugin, routing_key=None):
+        self.id = job_id
+        self.status = status
+        self.plugin = plugin
+        self.routing_key = routing_key
+
+
+class FileJobStore(object):
+    """
+    Job store keeping one json file per job in the job directory.
+
+    Job files are written atomically. Jobs are written one at a time
+    by the consumer, there are no concurrent writes to group so only
+    the none and always sync modes are supported.
+
+    Attributes
+
+    * :attr:`job_directory`
+      Directory the job files are written to
+
+    * :attr:`sync`
+      One of none or always
+
+    * :attr:`recovery_threads`
+      Number of threads decoding job files on restart
+    """
+    def __init__(self, job_directory, sync='none', recovery_threads=4):
+        self.job_directory = job_directory
+        self.sync = sync
+        self.recovery_threads = recovery_threads
+
+    def _get_job_file(self, job_id):
+        return '{0}job-{1}.json'.format(self.job_directory, job_id)
+
+    def add(self, job_id, job_config):
+        """
+        Persist the job config to the job file.
+        """
+        persist_json(
+            self._get_job_file(job_id),
+            job_config,
+            sync=self.sync
+        )
+
+    def load(self, job_id):
+        """
+        Return the job config from the job file.
+        """
+        return load_json(self._get_job_file(job_id))
+
+    def exists(self, job_id):
+        """
+        Return True if the job is stored.
+        """
+        return os.path.exists(self._get_job_file(job_id))
+
+    def remove(self, job_id):
+        """
+        Remove the job file.
+        """
+        remove_file(self._get_job_file(job_id))
+
+    def restart_jobs(self, callback, log=None):
+        """
+        Restart all stored jobs using callback.
+
+        Unreadable job files are moved to the quarantine directory.
+        """
+        return restart_jobs(
+            self.job_directory,
+            callback,
+            workers=self.recovery_threads,
+            log=log
+        )
+
+    def close(self):
+        pass
+
+
+class JournalJobStore(object):
+    """
+    Job store backed by a segmented append-only journal.
+
+    Each add or remove appends one compact json record per line to the
+    active segment, which is rolled over once it exceeds segment_size.
+    Adds are durable when add returns. Depending on sync the segment
+    is fsynced for every add (always), once for a group of concurrent
+    adds (group) or never (none). Removes are only flushed, losing one
+    on a crash means the job runs again.
+
+    A background thread compacts the sealed segments every
+    compaction_interval seconds by rewriting the jobs still live into
+    a single segment.
+
+    The segment and offset of the add record of each live job is kept
+    to load the job config, compaction moves the locations of the jobs
+    it rewrites. The locations are replayed when the store is opened,
+    job configs are only read when a job is loaded.
+
+    Attributes
+
+    * :attr:`journal_directory`
+      Directory the journal segments are written to
+
+    * :attr:`segment_size`
+      Size in bytes at which the active segment is rolled over
+
+    * :attr:`sync`
+      One of none, always or group
+
+    * :attr:`commit_window`
+      Seconds a group commit waits for more adds to join
+
+    * :attr:`compaction_interval`
+      Seconds between compaction runs
+    """
+    def __init__(
+        self, journal_directory, segment_size=64 * 1024 * 1024,
+        sync='none', commit_window=0.0, compaction_interval=60
+    ):
+        self.journal_directory = journal_directory
+        self.segment_size = segment_size
+        self.sync = sync
+        self.commit_window = commit_window
+        self.compaction_interval = compaction_interval
+
+        self.lock = threading.Lock()
+        self.compaction_lock = threading.Lock()
+        self.committer = GroupCommit(self._sync, commit_window)
+
+        self._segment = None
+        self._segment_id = 0
+        self._removed = 0
+        self._locations = {}
+        self._closed = threading.Event()
+
+        os.makedirs(self.journal_directory, exist_ok=True)
+
+        segments = self._get_segments()
+        self._locations = self._replay(segments)
+        self._open_segment(segments[-1] + 1 if segments else 1)
+
+        self._compactor = threading.Thread(
+            target=self._run_compaction,
+            name='journal-compaction',
+            daemon=True
+        )
+        self._compactor.start()
+
+    def _get_segments(self):
+        """
+        Return the ids of all segments in the journal in order.
+        """
+        return get_journal_segments(self.journal_directory)
+
+    def _get_segment_file(self, segment_id):
+        return os.path.join(
+            self.journal_directory,
+            SEGMENT_TEMPLATE.format(segment_id)
+        )
+
+    def _open_segment(self, segment_id):
+        """
+        Open a new active segment, sealing the current one.
+
+        Must be called with the lock held.
+        """
+        if self._segment:
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+            self._segment.close()
+
+        self._segment_id = segment_id
+        self._segment = open(self._get_segment_file(segment_id), 'ab')
+
+    def _append(self, record):
+        """
+        Append the record to the active segment.
+
+        Must be called with the lock held. Returns the segment and
+        offset the record was written to.
+        """
+        line = (JsonFormat.json_compact(record) + '\n').encode('utf-8')
+
+        if self._segment.tell() >= self.segment_size:
+            self._open_segment(self._segment_id + 1)
+
+        location = (self._segment_id, self._segment.tell())
+        self._segment.write(line)
+        self._segment.flush()
+
+        return location
+
+    def _sync(self):
+        """
+        Fsync the active segment.
+
+        A duplicate descriptor is used so a concurrent rollover
+        cannot close the file while it is synced.
+        """
+        with self.lock:
+            fd = os.dup(self._segment.fileno())
+
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def add(self, job_id, job_config):
+        """
+        Append an add record for the job and wait until it is durable.
+        """
+        record = {'op': 'add', 'id': job_id, 'job': job_config}
+
+        with self.lock:
+            self._locations[job_id] = self._append(record)
+
+        if self.sync == 'group':
+            self.committer.commit()
+        elif self.sync == 'always':
+            self._sync()
+
+    def remove(self, job_id):
+        """
+        Append a remove record for the job.
+        """
+        with self.lock:
+            self._append({'op': 'del', 'id': job_id})
+            self._locations.pop(job_id, None)
+            self._removed += 1
+
+    def exists(self, job_id):
+        """
+        Return True if the job is stored.
+        """
+        with self.lock:
+            return job_id in self._locations
+
+    def load(self, job_id):
+        """
+        Return the job config from the add record of the job.
+
+        The lock is held while reading so compaction cannot replace
+        the segment in between.
+        """
+        with self.lock:
+            segment_id, offset = self._locations[job_id]
+
+            with open(self._get_segment_file(segment_id), 'rb') as segment:
+                segment.seek(offset)
+                line = segment.readline()
+
+        return JsonFormat.json_loads(line.decode('utf-8'))['job']
+
+    def _replay(self, segment_ids):
+        """
+        Replay the segments and return the live jobs in add order.
+
+        The jobs map the job id to the location of its add record. A
+        torn record at the end of a segment from a crash mid write is
+        skipped.
+        """
+        jobs = {}
+
+        for segment_id in segment_ids:
+            segment_file = self._get_segment_file(segment_id)
+            offset = 0
+
+            with open(segment_file, 'rb') as segment:
+                for line_number, line in enumerate(segment, 1):
+                    location = (segment_id, offset)
+                    offset += len(line)
+
+                    try:
+                        record = JsonFormat.json_loads(line.decode('utf-8'))
+                    except ValueError:
+                        logger.warning(
+                            'Skipping invalid record {0}:{1}.'.format(
+                                segment_file,
+                                line_number
+                            )
+                        )
+                        continue
+
+                    if record['op'] == 'add':
+                        jobs[record['id']] = location
+                    else:
+                        jobs.pop(record['id'], None)
+
+        return jobs
+
+    def restart_jobs(self, callback, log=None):
+        """
+        Restart all jobs live when the store was opened using callback.
+
+        Job configs are loaded one at a time. Jobs removed meanwhile
+        finished and are skipped. Jobs that cannot be restarted are
+        logged and skipped, they stay in the journal until removed.
+        """
+        log = log or logger
+        summary = {'recovered': 0, 'quarantined': 0, 'skipped': 0}
+        start = time.monotonic()
+
+        with self.lock:
+            job_ids = list(self._locations)
+
+        for job_id in job_ids:
+            try:
+                job_config = self.load(job_id)
+            except KeyError:
+                summary['skipped'] += 1
+                continue
+
+            try:
+                callback(job_config)
+            except Exception as error:
+                log.error(
+                    'Failed to restart job {0}: {1}'.format(job_id, error)
+                )
+                summary['quarantined'] += 1
+            else:
+                summary['recovered'] += 1
+
+        summary['seconds'] = time.monotonic() - start
+        log.info(
+            'Recovery finished: {0} jobs recovered, {1} failed, '
+            '{2} already finished in {3:.2f}s.'.format(
+                summary['recovered'],
+                summary['quarantined'],
+                summary['skipped'],
+                summary['seconds']
+            )
+        )
+
+        return summary
+
+    def compact(self):
+        """
+        Rewrite the live jobs of all sealed segments into one segment.
+
+        The active segment is rolled over first so every existing
+        segment is sealed. The compacted segment replaces the newest
+        sealed one so it is replayed before any later records.
+        """
+        with self.compaction_lock:
+            with self.lock:
+                if not self._removed:
+                    return
+
+                self._removed = 0
+                if self._segment.tell():
+                    self._open_segment(self._segment_id + 1)
+
+                sealed = [
+                    segment_id for segment_id in self._get_segments()
+                    if segment_id < self._segment_id
+                ]
+
+            if not sealed:
+                return
+
+            jobs = self._replay(sealed)
+            target = self._get_segment_file(sealed[-1])
+            temp_file = target + '.compact'
+            locations = {}
+            sources = {}
+
+            try:
+                with open(temp_file, 'wb') as segment:
+                    # Add records are copied as is, one at a time
+                    for job_id, (segment_id, offset) in jobs.items():
+                        if segment_id not in sources:
+                            sources[segment_id] = open(
+                                self._get_segment_file(segment_id), 'rb'
+                            )
+
+                        source = sources[segment_id]
+                        source.seek(offset)
+                        locations[job_id] = (sealed[-1], segment.tell())
+                        segment.write(source.readline())
+
+                    segment.flush()
+                    os.fsync(segment.fileno())
+            finally:
+                for source in sources.values():
+                    source.close()
+
+            with self.lock:
+                os.replace(temp_file, target)
+
+                for segment_id in sealed[:-1]:
+                    remove_file(self._get_segment_file(segment_id))
+
+                for job_id, location in locations.items():
+                    # Jobs removed or added again meanwhile are skipped
+                    current = self._locations.get(job_id)
+                    if current and current[0] in sealed:
+                        self._locations[job_id] = location
+
+            logger.info(
+                'Compacted {0} journal segments, {1} live jobs.'.format(
+                    len(sealed),
+                    len(jobs)
+                )
+            )
+
+    def _run_compaction(self):
+        while not self._closed.wait(self.compaction_interval):
+            try:
+                self.compact()
+            except Exception as error:
+                logger.error('Journal compaction failed: {0}'.format(error))
+
+    def close(self):
+        """
+        Stop compaction, sync and close the active segment.
+        """
+        self._closed.set()
+        self._compactor.join()
+
+        with self.lock:
+            if self._segment:
+                self._segment.flush()
+                os.fsync(self._segment.fileno())
+                self._segment.close()
+                self._segment = None
+
+
+def get_job_store(config, job_directory):
+    """
+    Return the job store backend configured for the service.
+    """
+    backend = config.get_job_store()
+    sync = config.get_job_store_sync()
+
+    if backend == 'file':
+        if sync == 'group':
+            raise MQSFConfigException(
+                'job_store_sync group requires the journal job store.'
+            )
+
+        return FileJobStore(
+            job_directory,
+            sync=sync,
+            recovery_threads=config.get_recovery_threads()
+        )
+    elif backend == 'journal':
+        return JournalJobStore(
+            os.path.join(job_directory, 'journal'),
+            segment_size=config.get_journal_segment_size(),
+            sync=sync,
+            commit_window=config.get_job_store_commit_window(),
+            compaction_interval=config.get_journal_compaction_interval()
+        )
+
+    raise MQSFConfigException(
+        'job_store must be one of file or journal.'
+    )
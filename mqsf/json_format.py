@@ -18,18 +18,53 @@
 
 import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+BACKENDS = ('orjson', 'json')
+
 
 class JsonFormat(object):
     """
     Helper class to handle unicode characters
     in json formatted messages correctly
+
+    The pretty format is meant for humans. The compact format is used
+    on the wire and on disk and is encoded with the fastest available
+    backend, orjson if installed and the stdlib json module otherwise.
     """
+    backend = 'orjson' if orjson else 'json'
+
+    @classmethod
+    def set_backend(cls, backend=None):
+        """
+        Set the json backend, pick the fastest one installed if None.
+        """
+        if backend is None:
+            backend = 'orjson' if orjson else 'json'
+
+        if backend not in BACKENDS:
+            raise ValueError(
+                'JSON backend must be one of {0}.'.format(', '.join(BACKENDS))
+            )
+
+        if backend == 'orjson' and not orjson:
+            raise ValueError('JSON backend orjson is not installed.')
+
+        cls.backend = backend
+
     @staticmethod
     def json_load(file_handle):
-        return json.load(file_handle)
+        return JsonFormat.json_loads(file_handle.read())
 
     @staticmethod
     def json_loads(json_text):
+        if JsonFormat.backend == 'orjson':
+            return orjson.loads(json_text)
+
         return json.loads(json_text)
 
     @staticmethod
@@ -37,3 +72,14 @@ class JsonFormat(object):
         return json.dumps(
             data_dict, sort_keys=True, indent=4, separators=(',', ': ')
         )
+
+    @staticmethod
+    def json_compact(data_dict):
+        if JsonFormat.backend == 'orjson':
+            try:
+                return orjson.dumps(data_dict).decode('utf-8')
+            except TypeError:
+                # orjson is stricter, e.g. on non str dict keys
+                pass
+
+        return json.dumps(data_dict, separators=(',', ':'))
@@ -0,0 +1,85 @@
+# Copyright (c) 2023 SUSE LLC.  All rights reserved.
+#
+# This file is part of mqsf.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+
+import logging
+
+from functools import partial
+
+logger = logging.getLogger('LifecycleHooks')
+
+LIFECYCLE_HOOKS = (
+    'mqsf_message_received',
+    'mqsf_job_scheduled',
+    'mqsf_job_started',
+    'mqsf_job_finished',
+    'mqsf_message_published'
+)
+
+
+class LifecycleHooks(object):
+    """
+    Callers for the lifecycle hooks that have implementations.
+
+    Each hook is an attribute set to a caller of the hook if a plugin
+    implements it and None otherwise. Exceptions raised by a hook
+    implementation are logged so a faulty plugin cannot abort message
+    handling. Call sites check the attribute
+    first so unused hooks cost a single attribute lookup:
+
+        if self.lifecycle.mqsf_job_started:
+            self.lifecycle.mqsf_job_started(...)
+
+    Plugins registered after refresh are only called once refresh
+    runs again.
+
+    Attributes
+
+    * :attr:`plugin_manager`
+      Plugin manager the hookspecs are added to
+
+    * :attr:`log`
+      Logger for failed hook calls
+    """
+    def __init__(self, plugin_manager, log=None):
+        self.plugin_manager = plugin_manager
+        self.log = log or logger
+        self.refresh()
+
+    def refresh(self):
+        """
+        Look up which lifecycle hooks have implementations.
+        """
+        for name in LIFECYCLE_HOOKS:
+            caller = getattr(self.plugin_manager.hook, name, None)
+
+            if caller is None or not caller.get_hookimpls():
+                setattr(self, name, None)
+            else:
+                setattr(self, name, partial(self._call_hook, name, caller))
+
+    def _call_hook(self, name, caller, **kwargs):
+        """
+        Call the hook and log exceptions raised by implementations.
+        """
+        try:
+            caller(**kwargs)
+        except Exception as error:
+            self.log.error(
+                'Lifecycle hook {0} failed: {1}'.format(name, error),
+                extra={'job_id': kwargs.get('job_id')}
+            )
@@ -16,16 +16,34 @@
 #
 # -*- coding: utf-8 -*-
 
-import json
+import gzip
+import logging
+import os
+import queue
+import shutil
+import threading
 
-from amqpstorm import Connection
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    SocketHandler,
+    TimedRotatingFileHandler
+)
 
-from logging.handlers import SocketHandler
+from mqsf.connection import get_connection_manager
+from mqsf.json_format import JsonFormat
+
+OVERFLOW_POLICIES = ('drop', 'block', 'spill')
+ROTATION_TYPES = ('none', 'size', 'time')
 
 
 class MQHandler(SocketHandler):
     """
     Log handler for sending messages to MQ.
+
+    Messages are published on a channel of the connection manager,
+    by default the process wide connection for the MQ settings.
     """
     def __init__(
         self,
@@ -34,7 +52,10 @@ class MQHandler(SocketHandler):
         exchange='logger',
         username='guest',
         password='guest',
-        routing_key='mqsf.logger'
+        routing_key='mqsf.logger',
+        virtual_host='/',
+        heartbeat=600,
+        connection_manager=None
     ):
         """
         Initialize the handler instance.
@@ -46,19 +67,38 @@ class MQHandler(SocketHandler):
         self.exchange = exchange
         self.routing_key = routing_key
 
+        if connection_manager:
+            self.connection_manager = connection_manager.acquire()
+        else:
+            self.connection_manager = get_connection_manager(
+                host,
+                username,
+                password,
+                port,
+                virtual_host=virtual_host,
+                heartbeat=heartbeat
+            )
+
     def makeSocket(self):
         """
         Create a new instance of MQ socket connection.
         """
         return MQSocket(
-            self.host,
-            self.port,
-            self.username,
-            self.password,
+            self.connection_manager,
             self.exchange,
             self.routing_key
         )
 
+    def close(self):
+        """
+        Close the socket and release the shared connection.
+        """
+        super(MQHandler, self).close()
+
+        if self.connection_manager:
+            self.connection_manager.release()
+            self.connection_manager = None
+
     def makePickle(self, record):
         """
         Format the log message to a json string.
@@ -72,43 +112,278 @@ class MQHandler(SocketHandler):
             if hasattr(record, attr):
                 data[attr] = getattr(record, attr)
 
-        return json.dumps(data, sort_keys=True)
+        return JsonFormat.json_compact(data)
 
 
-class MQSocket(object):
+class AsyncMQHandler(MQHandler):
     """
-    MQ socket class.
+    Log handler shipping messages to MQ from a background thread.
+
+    Records are formatted by the logging thread and put on a bounded
+    queue, the shipper thread encodes and publishes them in batches.
+    If the queue is full the overflow policy applies:
+
+    * drop: discard the record
+    * block: wait for the shipper to make room
+    * spill: append the record to the spill file, records are shipped
+      from the spill file once the queue is drained
 
-    Maintains a connection for logging and publishing
-    logs to exchange.
+    Attributes
+
+    * :attr:`dropped`
+      Number of records discarded due to overflow or failed publishing
+
+    * :attr:`spilled`
+      Number of records written to the spill file
+
+    * :attr:`shipped`
+      Number of records published to MQ
     """
     def __init__(
-        self, host, port, username, password, exchange, routing_key
+        self,
+        host='localhost',
+        port=5672,
+        exchange='logger',
+        username='guest',
+        password='guest',
+        routing_key='mqsf.logger',
+        virtual_host='/',
+        heartbeat=600,
+        connection_manager=None,
+        queue_size=10000,
+        batch_size=100,
+        overflow='drop',
+        spill_file=None
     ):
+        """
+        Initialize the handler instance and start the shipper thread.
+        """
+        super(AsyncMQHandler, self).__init__(
+            host=host,
+            port=port,
+            exchange=exchange,
+            username=username,
+            password=password,
+            routing_key=routing_key,
+            virtual_host=virtual_host,
+            heartbeat=heartbeat,
+            connection_manager=connection_manager
+        )
+
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                'Overflow policy must be one of: {0}.'.format(
+                    ', '.join(OVERFLOW_POLICIES)
+                )
+            )
+
+        if overflow == 'spill' and not spill_file:
+            raise ValueError('Spill overflow policy requires a spill file.')
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.overflow = overflow
+        self.spill_file = spill_file
+        self.spill_lock = threading.Lock()
+        self.counter_lock = threading.Lock()
+
+        self.dropped = 0
+        self.spilled = 0
+        self.shipped = 0
+
+        self.shipper = threading.Thread(
+            target=self._ship,
+            name='log-shipper',
+            daemon=True
+        )
+        self.shipper.start()
+
+    def prepare(self, record):
+        """
+        Return the log data of the record.
+
+        Unlike makePickle the record is not modified as other
+        handlers format the same record.
+        """
+        data = {'msg': self.format(record)}
+
+        if hasattr(record, 'job_id'):
+            data['job_id'] = record.job_id
+
+        return data
+
+    def emit(self, record):
+        """
+        Queue the record for the shipper thread.
+        """
+        try:
+            data = self.prepare(record)
+
+            try:
+                self.queue.put_nowait(data)
+            except queue.Full:
+                self._handle_overflow(data)
+        except Exception:
+            self.handleError(record)
+
+    def _handle_overflow(self, data):
+        """
+        Apply the overflow policy to the log data.
+        """
+        if self.overflow == 'block':
+            self.queue.put(data)
+        elif self.overflow == 'spill':
+            self._spill([JsonFormat.json_compact(data)])
+        else:
+            self._count('dropped')
+
+    def _count(self, counter, value=1):
+        """
+        Increment the counter by value.
+        """
+        with self.counter_lock:
+            setattr(self, counter, getattr(self, counter) + value)
+
+    def _spill(self, messages):
+        """
+        Append the encoded messages to the spill file.
+        """
+        if not messages:
+            return
+
+        with self.spill_lock:
+            with open(self.spill_file, 'a') as spill_file:
+                for message in messages:
+                    spill_file.write(message + '\n')
+
+        self._count('spilled', len(messages))
+
+    def _ship(self):
+        """
+        Publish queued records in batches until the sentinel is queued.
+        """
+        while True:
+            try:
+                batch = [self.queue.get(timeout=1)]
+            except queue.Empty:
+                self._ship_spilled()
+                continue
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in batch
+            self._publish_batch([
+                JsonFormat.json_compact(data)
+                for data in batch if data is not None
+            ])
+
+            if stop:
+                break
+
+        self._ship_spilled()
+
+    def _publish_batch(self, messages):
+        """
+        Publish the messages over one channel.
+
+        Messages that fail to publish are spilled if the overflow
+        policy is spill, otherwise they are dropped. Return True if
+        all messages are published.
+        """
+        sent = 0
+
+        try:
+            if self.sock is None:
+                self.createSocket()
+
+            if self.sock:
+                for message in messages:
+                    self.sock.sendall(message)
+                    sent += 1
+        except Exception:
+            if self.sock:
+                self.sock.close()
+                self.sock = None
+
+        self._count('shipped', sent)
+
+        failed = messages[sent:]
+        if not failed:
+            return True
+
+        if self.overflow == 'spill':
+            self._spill(failed)
+        else:
+            self._count('dropped', len(failed))
+
+        return False
+
+    def _ship_spilled(self):
+        """
+        Publish the records in the spill file.
+        """
+        if not self.spill_file or not os.path.exists(self.spill_file):
+            return
+
+        with self.spill_lock:
+            try:
+                with open(self.spill_file, 'r') as spill_file:
+                    messages = spill_file.read().splitlines()
+            except FileNotFoundError:
+                return
+
+            os.remove(self.spill_file)
+
+        for index in range(0, len(messages), self.batch_size):
+            end = index + self.batch_size
+
+            if not self._publish_batch(messages[index:end]):
+                # MQ is unavailable, keep the rest for the next attempt
+                self._spill(messages[end:])
+                break
+
+    def close(self):
+        """
+        Ship the queued records and close the handler.
+        """
+        if self.shipper.is_alive():
+            self.queue.put(None)
+            self.shipper.join()
+
+        super(AsyncMQHandler, self).close()
+
+
+class MQSocket(object):
+    """
+    MQ socket class.
+
+    Maintains a channel on the shared connection for
+    publishing logs to exchange.
+    """
+    def __init__(self, connection_manager, exchange, routing_key):
         """
         Initialize RabbitMQ socket instance.
         """
-        self.host = host
-        self.port = port
-        self.username = username
-        self.password = password
+        self.connection_manager = connection_manager
         self.exchange = exchange
         self.routing_key = routing_key
-        self.connection = None
         self.channel = None
         self.open()
         self.declare_exchange()
 
     def close(self):
         """
-        Close socket connection.
+        Close socket channel.
+
+        The connection is shared and closed by the connection manager.
         """
         if self.channel and self.channel.is_open:
             self.channel.close()
 
-        if self.connection and self.connection.is_open:
-            self.connection.close()
-
     def declare_exchange(self):
         self.channel.exchange.declare(
             exchange=self.exchange,
@@ -118,19 +393,10 @@ class MQSocket(object):
 
     def open(self):
         """"
-        Create/open connection and declare logging exchange.
-        """
-        if not self.connection or self.connection.is_closed:
-            self.connection = Connection(
-                self.host,
-                self.username,
-                self.password,
-                port=self.port,
-                kwargs={'heartbeat': 600}
-            )
-
+        Open channel on the shared connection.
+        """
         if not self.channel or self.channel.is_closed:
-            self.channel = self.connection.channel()
+            self.channel = self.connection_manager.channel()
 
     def sendall(self, msg):
         """
@@ -146,3 +412,120 @@ class MQSocket(object):
                 'delivery_mode': 2
             }
         )
+
+
+class AsyncFileHandler(QueueHandler):
+    """
+    Log handler writing to a file from a background listener thread.
+
+    Records are formatted by the logging thread and buffered in a
+    queue, the listener writes them to the file handler. The file
+    is rotated by size or time if configured and rotated files may
+    be compressed with gzip.
+
+    Attributes
+
+    * :attr:`file_handler`
+      Handler writing the records to the log file
+
+    * :attr:`listener`
+      Queue listener thread passing records to the file handler
+    """
+    def __init__(
+        self,
+        filename,
+        rotation='none',
+        max_bytes=0,
+        when='midnight',
+        backup_count=0,
+        compress=False
+    ):
+        """
+        Initialize the handler and start the listener thread.
+        """
+        super(AsyncFileHandler, self).__init__(queue.SimpleQueue())
+
+        self.file_handler = create_file_handler(
+            filename,
+            rotation=rotation,
+            max_bytes=max_bytes,
+            when=when,
+            backup_count=backup_count,
+            compress=compress
+        )
+        self.listener = QueueListener(self.queue, self.file_handler)
+        self.listener.start()
+
+    def close(self):
+        """
+        Write the buffered records and close the log file.
+        """
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+            self.file_handler.close()
+
+        super(AsyncFileHandler, self).close()
+
+
+def create_file_handler(
+    filename,
+    rotation='none',
+    max_bytes=0,
+    when='midnight',
+    backup_count=0,
+    compress=False
+):
+    """
+    Return the file handler for the rotation type.
+
+    Rotation is either none, size based with max_bytes per file
+    or time based with the interval type in when. Without rotation
+    the file grows without bound.
+    """
+    if rotation not in ROTATION_TYPES:
+        raise ValueError(
+            'Rotation must be one of: {0}.'.format(', '.join(ROTATION_TYPES))
+        )
+
+    if rotation == 'size':
+        handler = RotatingFileHandler(
+            filename,
+            maxBytes=max_bytes,
+            backupCount=backup_count,
+            encoding='utf-8'
+        )
+    elif rotation == 'time':
+        handler = TimedRotatingFileHandler(
+            filename,
+            when=when,
+            backupCount=backup_count,
+            encoding='utf-8',
+            utc=True
+        )
+    else:
+        return logging.FileHandler(filename=filename, encoding='utf-8')
+
+    if compress:
+        handler.namer = gzip_namer
+        handler.rotator = gzip_rotator
+
+    return handler
+
+
+def gzip_namer(name):
+    """
+    Return the name of a rotated log file with gzip extension.
+    """
+    return name + '.gz'
+
+
+def gzip_rotator(source, dest):
+    """
+    Compress the rotated log file to dest and remove the source.
+    """
+    with open(source, 'rb') as source_file:
+        with gzip.open(dest, 'wb') as dest_file:
+            shutil.copyfileobj(source_file, dest_file)
+
+    os.remove(source)
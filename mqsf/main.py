@@ -17,25 +17,51 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import signal
 import sys
+import threading
 import traceback
 
 # project
+from mqsf.config.base_config import BaseConfig, SERVICE_CONFIG_FILE_TEMPLATE
+from mqsf.dispatcher import WorkerBudget
 from mqsf.exceptions import MQSFException
 from mqsf.message_service import MessageService
+from mqsf.supervisor import Supervisor
 
 
-def run_service(service_name):
+def run_service(service_name, service_class=MessageService, processes=None):
     """
     mqsf - create service application entry point
+
+    Pass AsyncMessageService as service_class to run jobs on an
+    asyncio event loop.
+
+    With more than one process, by default worker_processes from the
+    service config, a supervisor forks and restarts the workers.
     """
     try:
         logging.basicConfig()
         log = logging.getLogger('MessageService')
         log.setLevel(logging.DEBUG)
 
+        config = BaseConfig(SERVICE_CONFIG_FILE_TEMPLATE.format(service_name))
+
+        if processes is None:
+            processes = config.get_worker_processes()
+
+        if processes > 1:
+            Supervisor(
+                service_name,
+                service_class,
+                processes,
+                config.get_job_directory(service_name),
+                log
+            ).run()
+            return
+
         # run service, enter main loop
-        MessageService(
+        service_class(
             service_name=service_name
         )
     except MQSFException as e:
@@ -53,3 +79,80 @@ def run_service(service_name):
         log.error('Unexpected error: {0}'.format(e))
         traceback.print_exc()
         sys.exit(1)
+
+
+def run_services(services, service_class=MessageService, workers=None):
+    """
+    mqsf - host several services in one process
+
+    Services are given by name or as (service_name, service_class)
+    tuples. Each service keeps its own config, queue and job directory
+    and consumes in its own thread. Services with the same MQ settings
+    share one connection and all share the plugin registry.
+
+    With workers at most that many jobs run at once across all
+    services.
+    """
+    logging.basicConfig()
+    log = logging.getLogger('MessageService')
+    log.setLevel(logging.DEBUG)
+
+    budget = WorkerBudget(workers) if workers else None
+    stopping = threading.Event()
+    instances = []
+    threads = []
+
+    def stop(signum=None, frame=None):
+        stopping.set()
+
+    try:
+        for service in services:
+            if isinstance(service, str):
+                service = (service, service_class)
+
+            service_name, service_type = service
+            instances.append(service_type(
+                service_name=service_name,
+                autostart=False,
+                worker_budget=budget
+            ))
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        for instance in instances:
+            thread = threading.Thread(
+                target=instance.start,
+                name=instance.service_name,
+                daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+
+        # Wake up regularly, signals are only handled between waits
+        while not stopping.wait(1):
+            if not any(thread.is_alive() for thread in threads):
+                break
+
+        for instance, thread in zip(instances, threads):
+            # Services that stopped on an error already shut down
+            if thread.is_alive():
+                instance.stop(signal.SIGTERM)
+
+        for thread in threads:
+            thread.join()
+    except MQSFException as e:
+        # known exception
+        log.error('{0}: {1}'.format(type(e).__name__, format(e)))
+        traceback.print_exc()
+        sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(0)
+    except SystemExit:
+        # user exception, program aborted by user
+        sys.exit(0)
+    except Exception as e:
+        # exception we did no expect, show python backtrace
+        log.error('Unexpected error: {0}'.format(e))
+        traceback.print_exc()
+        sys.exit(1)
@@ -16,29 +16,41 @@
 #
 # -*- coding: utf-8 -*-
 
-import json
 import os
 import signal
+import threading
+import time
+import uuid
+
+from collections import deque
+
+from functools import partial
 
 from amqpstorm import AMQPError
 
 from apscheduler import events
+from apscheduler.events import JobExecutionEvent
 from apscheduler.jobstores.base import ConflictingIdError
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.executors.pool import ThreadPoolExecutor
 
 from pytz import utc
 
 from mqsf.service import Service
+from mqsf.acknowledger import BatchAcknowledger
 from mqsf.status_levels import EXCEPTION, SUCCESS
+from mqsf.executors import create_executor, run_job_in_process
+from mqsf.dedup import get_dedup_index
+from mqsf.dispatcher import JobBatcher, JobDispatcher, RUN
+from mqsf.exceptions import MessageServiceException
 from mqsf.job_factory import BaseJobFactory
+from mqsf.lifecycle import LifecycleHooks
 from mqsf import no_op_job, plugin_manager
 from mqsf.hookspecs import MQSFSpec
-from mqsf.json_format import JsonFormat
+from mqsf.codec import get_codec
+from mqsf.job_store import JobRecord, get_job_store
 from mqsf.utils import (
-    remove_file,
-    persist_json,
-    restart_jobs,
+    adopt_job_files,
+    get_worker_directory,
     setup_logfile
 )
 
@@ -46,29 +58,84 @@ from mqsf.utils import (
 class MessageService(Service):
     """
     Base class for message services that live in the image listener.
+
+    Attributes
+
+    * :attr:`autostart`
+      Start consuming when initialized, blocks until the service stops
+
+    * :attr:`worker_budget`
+      Limit of running jobs shared with other services in the process
+
+    * :attr:`worker_id`
+      Index of the worker process if the service runs in several
     """
+    def __init__(
+        self,
+        service_name,
+        autostart=True,
+        worker_budget=None,
+        worker_id=None,
+        **kwargs
+    ):
+        self.autostart = autostart
+        self.worker_budget = worker_budget
+        self.worker_id = worker_id
+        super(MessageService, self).__init__(service_name, **kwargs)
+
     def post_init(self):
         """Initialize base service class and job scheduler."""
         self.listener_queue = f'{self.service_name}.listener'
 
         self.jobs = {}
+        self.jobs_lock = threading.Lock()
+        # Configs of started jobs, queued jobs only keep a record
+        self.job_configs = {}
+        self.delivery_tags = {}
+        # Tags of completed jobs, acked on the consumer thread
+        self.completed_tags = deque()
+        # Ids of jobs parked per executor while it is full
+        self.parked = {}
+        self.job_priorities = {}
+        self.batches = {}
 
         # setup service job directory
-        self.job_directory = self.config.get_job_directory(
+        service_directory = self.config.get_job_directory(
             self.service_name
         )
+        self.job_directory = service_directory
+        log_file = self.config.get_log_file(self.service_name)
+
+        if self.worker_id is not None:
+            # Workers recover and rotate only their own files
+            self.job_directory = get_worker_directory(
+                self.job_directory,
+                self.worker_id
+            )
+            log_file = '{0}.worker-{1}'.format(log_file, self.worker_id)
         os.makedirs(
             self.job_directory, exist_ok=True
         )
 
+        self.publish_retry_count = self.config.get_publish_retry_count()
+        self.priority_field = self.config.get_priority_field()
+        self.batcher = JobBatcher(
+            self.config.get_batch_size(),
+            self.config.get_batch_window()
+        )
         self.prev_service = self.config.get_previous_service()
         self.exchange = self.config.get_mq_exchange()
         self.routing_key = self.config.get_mq_routing_key()
 
-        plugin_manager.add_hookspecs(MQSFSpec)
+        # Services in one process share the plugin manager
+        run_task = getattr(plugin_manager.hook, 'run_task', None)
+        if not run_task or not run_task.has_spec():
+            plugin_manager.add_hookspecs(MQSFSpec)
+
         plugin_manager.load_setuptools_entrypoints('mqsf')
 
-        if self.config.get_no_op_okay():
+        if self.config.get_no_op_okay() and \
+                not plugin_manager.has_plugin('NoOpJob'):
             plugin_manager.register(no_op_job, 'NoOpJob')
 
         # Create job factory
@@ -78,25 +145,60 @@ class MessageService(Service):
             plugin_key=self.config.get_plugin_key(),
             can_skip=self.config.get_no_op_okay()
         )
+        self.lifecycle = LifecycleHooks(plugin_manager, self.log)
 
         logfile_handler = setup_logfile(
-            self.config.get_log_file(self.service_name)
+            log_file,
+            async_write=self.config.get_log_async_write(),
+            rotation=self.config.get_log_rotation(),
+            max_bytes=self.config.get_log_max_bytes(),
+            when=self.config.get_log_rotation_interval(),
+            backup_count=self.config.get_log_backup_count(),
+            compress=self.config.get_log_compress()
         )
         self.log.addHandler(logfile_handler)
 
+        if self.worker_id is None:
+            # Recover jobs of workers from an earlier prefork run
+            moved = adopt_job_files(self.job_directory, 1, self.log)
+            if moved:
+                self.log.info(
+                    'Moved {0} worker job files and journal segments.'.format(
+                        moved
+                    )
+                )
+
+        self.job_store = get_job_store(self.config, self.job_directory)
+        self.dedup = get_dedup_index(self.config, service_directory)
+
         self.bind_queue(
             self.exchange,
             self.routing_key,
             self.listener_queue
         )
 
-        thread_pool_count = self.config.get_base_thread_pool_count()
-        executors = {
-            'default': ThreadPoolExecutor(thread_pool_count)
-        }
+        # Deferred acks keep unfinished jobs on the broker, the prefetch
+        # window then caps the number of jobs in flight.
+        self.deferred_ack = self.config.get_deferred_ack()
+        if self.deferred_ack:
+            self.prefetch_count = self.config.get_max_unacked_jobs()
+
+        ack_batch_size = self.config.get_ack_batch_size()
+        if self.prefetch_count:
+            # A batch larger than the prefetch window would only be
+            # flushed by the timeout as the broker stops delivering.
+            ack_batch_size = min(ack_batch_size, self.prefetch_count)
+
+        self.acknowledger = BatchAcknowledger(
+            self.channel,
+            batch_size=ack_batch_size,
+            max_delay=self.config.get_ack_batch_timeout()
+        )
+
+        executors = self._create_executors()
         self.scheduler = BackgroundScheduler(executors=executors, timezone=utc)
         self.scheduler.add_listener(
-            self._process_job_result,
+            self._handle_job_event,
             events.EVENT_JOB_EXECUTED | events.EVENT_JOB_ERROR
         )
         self.scheduler.add_listener(
@@ -104,20 +206,185 @@ class MessageService(Service):
             events.EVENT_JOB_MISSED
         )
 
-        signal.signal(signal.SIGINT, self.stop)
-        signal.signal(signal.SIGTERM, self.stop)
+        if self.autostart and \
+                threading.current_thread() is threading.main_thread():
+            # Signal handlers can only be set in the main thread,
+            # without autostart the caller handles signals.
+            signal.signal(signal.SIGINT, self.stop)
+            signal.signal(signal.SIGTERM, self.stop)
+
+        if self.worker_budget:
+            self.worker_budget.add_listener(self._start_waiting_jobs)
+
+        # Consume new messages while jobs are recovered
+        self.recovery = threading.Thread(
+            target=self.job_store.restart_jobs,
+            args=(self._add_job, self.log),
+            name='recovery',
+            daemon=True
+        )
+        self.recovery.start()
+
+        if self.autostart:
+            self.start()
+
+    def _get_default_workers(self):
+        """
+        Return the number of workers of the default executor.
+        """
+        return self.config.get_base_thread_pool_count()
+
+    def _get_metrics_port(self):
+        """
+        Return the metrics port, worker processes use consecutive ports.
+        """
+        metrics_port = super(MessageService, self)._get_metrics_port()
+
+        if metrics_port and self.worker_id:
+            metrics_port += self.worker_id
+
+        return metrics_port
+
+    def _setup_metrics(self):
+        """
+        Create the job and executor metrics of the service.
+        """
+        super(MessageService, self)._setup_metrics()
+
+        labels = ('service',)
+        self.messages_consumed = self.metrics.counter(
+            'mqsf_messages_consumed_total',
+            'Listener messages consumed.',
+            labelnames=labels
+        )
+        self.jobs_scheduled = self.metrics.counter(
+            'mqsf_jobs_scheduled_total',
+            'Jobs scheduled to run.',
+            labelnames=labels
+        )
+        self.jobs_run = self.metrics.counter(
+            'mqsf_jobs_run_total',
+            'Jobs finished running.',
+            labelnames=labels
+        )
+        self.jobs_failed = self.metrics.counter(
+            'mqsf_jobs_failed_total',
+            'Jobs finished without success.',
+            labelnames=labels
+        )
+        self.job_duration = self.metrics.histogram(
+            'mqsf_job_duration_seconds',
+            'Time to run the plugin task of a job or batch of jobs.',
+            labelnames=labels
+        )
+        self.executor_waiting_jobs = self.metrics.gauge(
+            'mqsf_executor_waiting_jobs',
+            'Jobs waiting for a worker of the executor.',
+            labelnames=('service', 'executor')
+        )
+        self.executor_running_jobs = self.metrics.gauge(
+            'mqsf_executor_running_jobs',
+            'Jobs running in the executor.',
+            labelnames=('service', 'executor')
+        )
+
+    def _create_executors(self):
+        """
+        Create the scheduler executors and the dispatcher lanes.
 
-        restart_jobs(self.job_directory, self._add_job)
-        self.start()
+        Besides the default executor a process executor exists if
+        executor_type maps plugins to it. Named executors from the
+        config are added and plugin_executors routes plugins to them.
+        """
+        thread_pool_count = self.config.get_base_thread_pool_count()
+        executor_type = self.config.get_executor_type()
+
+        if isinstance(executor_type, dict):
+            self.plugin_executors = {
+                plugin: 'process' for plugin, plugin_type
+                in executor_type.items() if plugin_type == 'process'
+            }
+            executor_type = 'thread'
+        else:
+            self.plugin_executors = {}
+
+        executor_configs = {
+            'default': {
+                'type': executor_type,
+                'workers': self._get_default_workers()
+            }
+        }
+        if self.plugin_executors:
+            executor_configs['process'] = {
+                'type': 'process',
+                'workers': thread_pool_count
+            }
+
+        for name, executor_config in self.config.get_executors().items():
+            executor_configs.setdefault(name, {}).update(executor_config)
+
+        self.plugin_executors.update(self.config.get_plugin_executors())
+
+        for plugin, name in self.plugin_executors.items():
+            if name not in executor_configs:
+                raise MessageServiceException(
+                    'Executor {0} for plugin {1} is not configured.'.format(
+                        name,
+                        plugin
+                    )
+                )
+
+        self.executor_types = {}
+        self.dispatcher = JobDispatcher(budget=self.worker_budget)
+        executors = {}
+
+        for name, executor_config in executor_configs.items():
+            name_type = executor_config.get('type', 'thread')
+            workers = executor_config.get('workers', thread_pool_count)
+
+            self.executor_types[name] = name_type
+            lane = self.dispatcher.add_lane(
+                name,
+                workers,
+                executor_config.get('max_queued')
+            )
+            self.executor_waiting_jobs.set_function(
+                partial(len, lane.waiting),
+                service=self.service_name,
+                executor=name
+            )
+            self.executor_running_jobs.set_function(
+                partial(getattr, lane, 'running'),
+                service=self.service_name,
+                executor=name
+            )
+            executors[name] = create_executor(name_type, workers)
+
+        return executors
 
     def _add_job(self, job_config):
         """
         Load and schedule job if job id does not already exist.
+
+        Jobs are recovered while messages are processed, a job that
+        finished after its config was read is no longer stored and
+        is skipped. Deleting a job removes it from the job store
+        before releasing the claim, so a successful claim sees it.
         """
         job_id = job_config['id']
 
-        if job_id not in self.jobs:
-            self.jobs[job_id] = job_config
+        if self._claim_job(job_id, job_config):
+            if not self.job_store.exists(job_id):
+                with self.jobs_lock:
+                    del self.jobs[job_id]
+
+                self.log.info(
+                    'Job already finished.',
+                    extra={'job_id': job_id}
+                )
+                return
+
+            self._set_priority(job_id, job_config)
             self.log.info(
                 'Job will be scheduled.',
                 extra={'job_id': job_id}
@@ -129,13 +396,92 @@ class MessageService(Service):
                 extra={'job_id': job_id}
             )
 
+    def _claim_job(self, job_id, job_config):
+        """
+        Add job to the queued jobs unless the job id is already queued.
+
+        Listener messages and job recovery may add jobs concurrently.
+        Only a record of the job is kept, the job config is loaded from
+        the job store when the job starts.
+        """
+        record = JobRecord(
+            job_id,
+            job_config.get('status'),
+            job_config.get(self.job_factory.plugin_key),
+            job_config.get('routing_key')
+        )
+
+        with self.jobs_lock:
+            if job_id in self.jobs:
+                return False
+
+            self.jobs[job_id] = record
+            return True
+
+    def _load_job(self, job_id):
+        """
+        Load the config of the job from the job store.
+
+        The config is kept until the job result is processed.
+        """
+        job_config = self.job_store.load(job_id)
+        self.job_configs[job_id] = job_config
+
+        return job_config
+
+    def _load_failed_job(self, job_id):
+        """
+        Load the config of a job that failed before it was loaded.
+
+        If the job store cannot load it either, e.g. the job file is
+        missing or corrupt, a config is built from the job record so
+        the job can still be cleaned up and reported.
+        """
+        try:
+            return self.job_store.load(job_id)
+        except Exception as error:
+            self.log.error(
+                'Failed to load job: {0}'.format(error),
+                extra={'job_id': job_id}
+            )
+
+        record = self.jobs[job_id]
+        return {
+            'id': job_id,
+            'status': EXCEPTION,
+            'errors': [],
+            'routing_key': record.routing_key,
+            self.job_factory.plugin_key: record.plugin
+        }
+
+    def _set_priority(self, job_id, job_config, message=None):
+        """
+        Set the dispatch priority of the job.
+
+        The priority is read from the configured message field or
+        the priority property of the listener message.
+        """
+        if self.priority_field:
+            priority = job_config.get(self.priority_field)
+        elif message:
+            priority = message.properties.get('priority')
+        else:
+            priority = None
+
+        try:
+            priority = int(priority)
+        except (TypeError, ValueError):
+            return
+
+        self.job_priorities[job_id] = priority
+
     def _cleanup_job(self, job_id):
         """
         Job failed upstream.
 
         Delete job and notify the next service.
         """
-        job_config = self.jobs[job_id]
+        job_config = self.job_store.load(job_id)
 
         self.log.warning('Failed upstream.', extra={'job_id': job_id})
         self._delete_job(job_id)
@@ -144,7 +490,7 @@ class MessageService(Service):
 
     def _delete_job(self, job_id):
         """
-        Remove job from file store and delete from listener queue.
+        Remove job from job store and delete from listener queue.
 
         Also attempt to remove any running instances of the job.
         """
@@ -154,14 +500,8 @@ class MessageService(Service):
                 extra={'job_id': job_id}
             )
 
+            self.job_store.remove(job_id)
             del self.jobs[job_id]
-
-            job_file = '{0}job-{1}.json'.format(
-                self.job_directory,
-                job_id
-            )
-
-            remove_file(job_file)
         else:
             self.log.warning(
                 'Job deletion failed, job is not queued.',
@@ -172,37 +512,181 @@ class MessageService(Service):
         """
         Callback for listener messages.
         """
-        listener_msg = self._get_listener_msg(message.body)
+        self.messages_consumed.inc(service=self.service_name)
+        listener_msg = self._get_listener_msg(message)
 
         job_id = None
         if listener_msg:
             status = listener_msg['status']
             job_id = listener_msg['id']
 
-        if job_id and job_id not in self.jobs:
-            self.jobs[job_id] = listener_msg
-            listener_msg['routing_key'] = message.method['routing_key']
+        if job_id and self.lifecycle.mqsf_message_received:
+            self.lifecycle.mqsf_message_received(
+                service=self,
+                job_id=job_id,
+                timestamp=time.monotonic(),
+                metadata={
+                    'status': status,
+                    'routing_key': message.method['routing_key']
+                }
+            )
 
-            job_file = '{0}job-{1}.json'.format(
-                self.job_directory,
-                job_id
+        if job_id and status == SUCCESS and \
+                self.dedup is not None and job_id in self.dedup and \
+                job_id not in self.jobs:
+            # Redelivered or replayed message of a completed job
+            self.log.warning(
+                'Job already completed, dropping message.',
+                extra={'job_id': job_id}
             )
-            persist_json(
-                job_file,
-                listener_msg
+            self.acknowledger.ack(message.delivery_tag)
+            return
+
+        if job_id and status == SUCCESS and job_id not in self.jobs:
+            executor = self._get_executor(
+                listener_msg.get(self.job_factory.plugin_key)
+            )
+
+            if executor in self.parked or self.dispatcher.is_full(executor):
+                self._accept_message(message, listener_msg, executor)
+                return
+
+        self._accept_message(message, listener_msg)
+
+    def _park_job(self, executor, job_id):
+        """
+        Hold the job until the executor accepts more jobs.
+
+        The job is stored and its message acknowledged as for any
+        accepted job, only the job id is held. Parked jobs do not take
+        up the prefetch window, so jobs of other executors keep being
+        delivered. Jobs for an executor are scheduled in the order
+        they arrived.
+        """
+        if executor not in self.parked:
+            self.log.warning(
+                'Executor {0} is full, parking jobs.'.format(executor)
             )
+            self.parked[executor] = deque()
+
+        self.parked[executor].append(job_id)
+
+    def _accept_parked(self):
+        """
+        Schedule parked jobs of executors that have room again.
+        """
+        for executor, job_ids in list(self.parked.items()):
+            while job_ids and not self.dispatcher.is_full(executor):
+                job_id = job_ids.popleft()
+
+                if job_id in self.jobs:
+                    self._schedule_job(job_id)
+
+            if not job_ids:
+                del self.parked[executor]
+
+    def _accept_message(self, message, listener_msg, parked_executor=None):
+        """
+        Store and schedule the job of the listener message.
+
+        With parked_executor set the job is parked for that executor
+        instead of being scheduled.
+        """
+        deferred = False
+        job_id = None
+
+        if listener_msg:
+            status = listener_msg['status']
+            job_id = listener_msg['id']
+            listener_msg['routing_key'] = message.method['routing_key']
+
+        if job_id and self._claim_job(job_id, listener_msg):
+            self._set_priority(job_id, listener_msg, message)
+            self.job_store.add(job_id, listener_msg)
 
             if status == SUCCESS:
-                self._schedule_job(job_id)
+                if self.deferred_ack:
+                    # Hold the ack until the job result is published
+                    deferred = True
+                    self.acknowledger.hold(message.delivery_tag)
+                    self.delivery_tags[job_id] = message.delivery_tag
+
+                if parked_executor:
+                    self._park_job(parked_executor, job_id)
+                else:
+                    self._schedule_job(job_id)
             else:
                 self._cleanup_job(job_id)
-        elif job_id in self.jobs:
+        elif job_id:
             self.log.warning(
                 'Job already queued.',
                 extra={'job_id': job_id}
             )
 
-        message.ack()
+        if not deferred:
+            self.acknowledger.ack(message.delivery_tag)
+
+    def _ack_job(self, job_id):
+        """
+        Acknowledge the listener message held back for the job.
+
+        Publish confirms arrive on executor and confirm threads, the
+        tag is queued and acknowledged on the consumer thread as the
+        channel must not be used from several threads. Jobs restarted
+        from the job directory have no delivery tag.
+        """
+        delivery_tag = self.delivery_tags.pop(job_id, None)
+
+        if delivery_tag is not None:
+            self.completed_tags.append(delivery_tag)
+
+    def _ack_completed(self):
+        """
+        Acknowledge the queued delivery tags of completed jobs.
+        """
+        while self.completed_tags:
+            self.acknowledger.ack(self.completed_tags.popleft())
+
+    def _handle_consumer_idle(self):
+        """
+        Flush acknowledgements and job batches that reached the max delay.
+        """
+        self._ack_completed()
+        self._accept_parked()
+        self.acknowledger.flush(force=False)
+
+        for job_ids in self.batcher.due():
+            self._dispatch_batch(job_ids)
+
+    def _handle_consumer_stopped(self):
+        """
+        Send the remaining acknowledgements before the channel closes.
+        """
+        self._ack_completed()
+        self.acknowledger.flush()
+
+    def _handle_job_event(self, event):
+        """
+        Callback when a scheduled job or batch of jobs finishes.
+
+        Release the executor worker and process the result of each job.
+        """
+        self._release_job(event.job_id)
+
+        job_ids = self.batches.pop(event.job_id, None)
+        if job_ids is None:
+            self._process_job_result(event)
+            return
+
+        for job_id in job_ids:
+            self._process_job_result(JobExecutionEvent(
+                event.code,
+                job_id,
+                event.jobstore,
+                event.scheduled_run_time,
+                exception=event.exception,
+                traceback=event.traceback
+            ))
 
     def _process_job_result(self, event):
         """
@@ -211,10 +695,19 @@ class MessageService(Service):
         Handle exceptions and errors that occur and logs info to job log.
         """
         job_id = event.job_id
-        job_config = self.jobs[job_id]
+        job_config = self.job_configs.pop(job_id, None)
+
+        if event.retval is not None:
+            # Job config mutated by the plugin in a worker process
+            job_config = event.retval
+        elif job_config is None:
+            # Job failed before its config was loaded
+            job_config = self._load_failed_job(job_id)
+
         metadata = {'job_id': job_id}
 
         self._delete_job(job_id)
+        self.jobs_run.inc(service=self.service_name)
 
         if event.exception:
             job_config['status'] = EXCEPTION
@@ -242,6 +735,23 @@ class MessageService(Service):
                 extra=metadata
             )
 
+        if job_config['status'] != SUCCESS:
+            self.jobs_failed.inc(service=self.service_name)
+        elif self.dedup is not None:
+            # Failed jobs may be retried by replaying the message
+            self.dedup.add(job_id)
+
+        if self.lifecycle.mqsf_job_finished:
+            self.lifecycle.mqsf_job_finished(
+                service=self,
+                job_id=job_id,
+                timestamp=time.monotonic(),
+                metadata={
+                    'status': job_config['status'],
+                    'exception': event.exception
+                }
+            )
+
         self._publish_message(job_config, job_id)
 
     def _process_job_missed(self, event):
@@ -263,27 +773,230 @@ class MessageService(Service):
     def _publish_message(self, job_config, job_id):
         """
         Publish message to next service exchange.
+
+        The listener message of the job is acknowledged once the
+        broker confirms the publish or all retries failed.
         """
         routing_key = self.get_next_routing_key(job_config)
         message = self._get_status_message(job_config)
+        priority = self.job_priorities.pop(job_id, None)
+
+        self._send_message(routing_key, message, job_id, priority)
+
+    def _send_message(
+        self, routing_key, message, job_id, priority=None, attempt=0
+    ):
+        """
+        Publish the message and handle a failed or rejected publish.
+
+        The job priority is passed on to the next service.
+        """
+        on_failure = partial(
+            self._handle_publish_failure,
+            routing_key,
+            message,
+            job_id,
+            priority,
+            attempt
+        )
 
         try:
-            self._publish(self.exchange, routing_key, message)
+            self._publish(
+                self.exchange,
+                routing_key,
+                message,
+                on_confirm=partial(self._ack_job, job_id),
+                on_failure=on_failure,
+                priority=priority
+            )
         except AMQPError:
+            on_failure()
+            return
+
+        if self.lifecycle.mqsf_message_published:
+            self.lifecycle.mqsf_message_published(
+                service=self,
+                job_id=job_id,
+                timestamp=time.monotonic(),
+                metadata={'routing_key': routing_key, 'attempt': attempt}
+            )
+
+    def _handle_publish_failure(
+        self, routing_key, message, job_id, priority, attempt
+    ):
+        """
+        Callback when a message was not confirmed by the broker.
+
+        Retry the publish up to the configured count and log the
+        message if it still cannot be delivered.
+        """
+        if attempt < self.publish_retry_count:
+            self.log.warning(
+                'Message not confirmed, retrying publish.',
+                extra={'job_id': job_id}
+            )
+            self._send_message(
+                routing_key,
+                message,
+                job_id,
+                priority,
+                attempt + 1
+            )
+        else:
             self.log.warning(
                 'Message not received: {0}'.format(message),
                 extra={'job_id': job_id}
             )
+            self._ack_job(job_id)
+
+    def _get_executor(self, plugin_name):
+        """
+        Return the name of the executor jobs of the plugin run in.
+        """
+        return self.plugin_executors.get(plugin_name, 'default')
 
     def _schedule_job(self, job_id):
+        """
+        Dispatch job to the executor for its plugin.
+
+        Jobs for plugins implementing run_tasks in a thread executor
+        are collected into batches per plugin first.
+        """
+        record = self.jobs[job_id]
+        executor = self._get_executor(record.plugin)
+        self.jobs_scheduled.inc(service=self.service_name)
+
+        if self.lifecycle.mqsf_job_scheduled:
+            self.lifecycle.mqsf_job_scheduled(
+                service=self,
+                job_id=job_id,
+                timestamp=time.monotonic(),
+                metadata={
+                    'executor': executor,
+                    'priority': self.job_priorities.get(job_id, 0)
+                }
+            )
+
+        if self.executor_types[executor] == 'thread':
+            batch_key = self._get_batch_key(record.plugin)
+
+            if batch_key:
+                job_ids = self.batcher.add(batch_key, job_id)
+
+                if job_ids:
+                    self._dispatch_batch(job_ids)
+                return
+
+        self._dispatch(job_id, executor, self.job_priorities.get(job_id, 0))
+
+    def _get_batch_key(self, plugin_name):
+        """
+        Return the plugin name if the job plugin takes batches.
+        """
+        try:
+            plugin = self.job_factory.get_plugin(plugin_name)
+        except Exception:
+            # Invalid jobs are handled when the job runs
+            return None
+
+        if hasattr(plugin, 'run_tasks'):
+            return plugin_name
+
+        return None
+
+    def _dispatch_batch(self, job_ids):
+        """
+        Dispatch the batch of jobs as a single scheduler job.
+        """
+        batch_id = 'batch-{0}'.format(uuid.uuid4())
+        self.batches[batch_id] = job_ids
+
+        self._dispatch(
+            batch_id,
+            self._get_executor(self.jobs[job_ids[0]].plugin),
+            max(self.job_priorities.get(job_id, 0) for job_id in job_ids)
+        )
+
+    def _dispatch(self, job_id, executor, priority):
+        """
+        Submit the job to the scheduler once the executor has a worker.
+
+        Waiting jobs start in order of priority. Jobs are queued even
+        if the executor is full, the listener rejects messages for
+        full executors upfront.
+        """
+        state = self.dispatcher.submit(
+            executor,
+            job_id,
+            priority=priority,
+            force=True
+        )
+
+        if state == RUN:
+            self._submit_job(job_id, executor)
+
+    def _release_job(self, job_id):
+        """
+        Release the worker of the job and start the next waiting job.
+        """
+        next_job_id = self.dispatcher.release(job_id)
+
+        if next_job_id:
+            self._submit_waiting_job(next_job_id)
+
+        if self.worker_budget:
+            self.worker_budget.notify()
+
+    def _start_waiting_jobs(self):
+        """
+        Start waiting jobs while the worker budget has free slots.
+        """
+        next_job_id = self.dispatcher.next_job()
+
+        while next_job_id:
+            self._submit_waiting_job(next_job_id)
+            next_job_id = self.dispatcher.next_job()
+
+    def _submit_waiting_job(self, job_id):
+        """
+        Submit the waiting job or batch that now holds a worker.
+        """
+        first_job_id = self.batches.get(job_id, [job_id])[0]
+        self._submit_job(
+            job_id,
+            self._get_executor(self.jobs[first_job_id].plugin)
+        )
+
+    def _submit_job(self, job_id, executor):
         """
         Schedule new job in background scheduler for job based on id.
+
+        Jobs for a process executor run the plugin in a worker process
+        on a copy of the job config.
         """
+        if job_id in self.batches:
+            func = self._start_batch
+            args = (job_id,)
+        elif self.executor_types[executor] == 'process':
+            # The worker process has no service to run hooks in
+            self._notify_job_started(job_id)
+            func = run_job_in_process
+            args = (
+                self.service_name,
+                self.job_factory.plugin_key,
+                self.job_factory.can_skip,
+                self._load_job(job_id)
+            )
+        else:
+            func = self._start_job
+            args = (job_id,)
+
         try:
             self.scheduler.add_job(
-                self._start_job,
-                args=(job_id,),
+                func,
+                args=args,
                 id=job_id,
+                executor=executor,
                 max_instances=1,
                 misfire_grace_time=None,
                 coalesce=True
@@ -299,23 +1012,60 @@ class MessageService(Service):
         """
         Process job based on job id.
         """
-        job_config = self.jobs[job_id]
+        job_config = self._load_job(job_id)
+        self._notify_job_started(job_id)
+        start = time.monotonic()
 
         try:
-            plugin = self.job_factory.create_job(job_config)
-        except Exception as error:
-            self.log.error(
-                'Invalid job: {0}.'.format(error)
+            self.job_factory.run_job(job_config, self.log, service=self)
+        finally:
+            self.job_duration.observe(
+                time.monotonic() - start,
+                service=self.service_name
+            )
+
+    def _notify_job_started(self, job_id):
+        """
+        Call the job started hook if implemented.
+        """
+        if self.lifecycle.mqsf_job_started:
+            self.lifecycle.mqsf_job_started(
+                service=self,
+                job_id=job_id,
+                timestamp=time.monotonic(),
+                metadata={'plugin': self.jobs[job_id].plugin}
+            )
+
+    def _start_batch(self, batch_id):
+        """
+        Process the batch of jobs with the run_tasks hook of the plugin.
+
+        If the plugin raises all jobs of the batch fail.
+        """
+        batch = []
+        for job_id in self.batches[batch_id]:
+            self._notify_job_started(job_id)
+            batch.append(self._load_job(job_id))
+
+        plugin = self.job_factory.create_job(batch[0])
+        start = time.monotonic()
+
+        try:
+            plugin.run_tasks(self, batch, self.log)
+        finally:
+            self.job_duration.observe(
+                time.monotonic() - start,
+                service=self.service_name
             )
-            job_config['status'] = EXCEPTION
-            job_config.get('errors', []).append(error)
-        else:
-            plugin.run_task(self, job_config, self.log)
 
     def _get_listener_msg(self, message):
-        """Load json and attempt to get message by key."""
+        """
+        Decode message body based on content type and return message.
+        """
+        content_type = message.properties.get('content_type')
+
         try:
-            listener_msg = json.loads(message)
+            listener_msg = get_codec(content_type).decode(message.body)
         except Exception as e:
             self.log.error('Invalid listener message: {0}'.format(str(e)))
             listener_msg = None
@@ -324,11 +1074,11 @@ class MessageService(Service):
 
     def _get_status_message(self, job_config):
         """
-        Build and return json message.
+        Build and return encoded message.
 
         Message contains completion status to post to next service exchange.
         """
-        return JsonFormat.json_message(job_config)
+        return self.codec.encode(job_config)
 
     def get_next_routing_key(self, message):
         """
@@ -349,7 +1099,7 @@ class MessageService(Service):
         )
 
         try:
-            self.channel.start_consuming()
+            self.start_consuming()
         except Exception:
             self.stop()
             raise
@@ -372,4 +1122,9 @@ class MessageService(Service):
             )
 
         self.scheduler.shutdown()
+        self.job_store.close()
+
+        if self.dedup is not None:
+            self.dedup.close()
+
         self.close_connection()
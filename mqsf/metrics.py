@@ -0,0 +1,377 @@
+# Copyright (c) 2023 SUSE LLC.  All rights reserved.
+#
+# This file is part of mqsf.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+
+import bisect
+import threading
+
+from abc import ABCMeta, abstractmethod
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+DEFAULT_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0
+)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metric(object, metaclass=ABCMeta):
+    """
+    Base class for metrics with a value per set of label values.
+
+    Attributes
+
+    * :attr:`name`
+      Name of the metric
+
+    * :attr:`documentation`
+      Help text of the metric
+
+    * :attr:`labelnames`
+      Names of the labels identifying a value
+    """
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, labels):
+        """
+        Return the label values in the order of the label names.
+        """
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key, extra=()):
+        """
+        Return the label set of the sample in exposition format.
+        """
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+
+        if not pairs:
+            return ''
+
+        return '{{{0}}}'.format(','.join(
+            '{0}="{1}"'.format(name, _escape(value))
+            for name, value in pairs
+        ))
+
+    @abstractmethod
+    def samples(self):
+        """
+        Return the exposition lines of the metric values.
+        """
+
+    def expose(self):
+        """
+        Return the metric in Prometheus text format.
+        """
+        lines = [
+            '# HELP {0} {1}'.format(self.name, self.documentation),
+            '# TYPE {0} {1}'.format(self.name, self.metric_type)
+        ]
+        lines.extend(self.samples())
+        return lines
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing value.
+    """
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """
+        Increment the value for the labels by amount.
+        """
+        key = self._key(labels)
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [
+                '{0}{1} {2}'.format(
+                    self.name, self._format_labels(key), value
+                ) for key, value in self.values.items()
+            ]
+
+
+class Gauge(Metric):
+    """
+    Value that goes up and down.
+
+    Functions registered with set_function are called on exposition
+    for values read from other objects, e.g. queue lengths.
+    """
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super(Gauge, self).__init__(name, documentation, labelnames)
+        self.functions = {}
+
+    def set(self, value, **labels):
+        """
+        Set the value for the labels.
+        """
+        key = self._key(labels)
+
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        """
+        Increment the value for the labels by amount.
+        """
+        key = self._key(labels)
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        """
+        Decrement the value for the labels by amount.
+        """
+        self.inc(-amount, **labels)
+
+    def set_function(self, function, **labels):
+        """
+        Set a function returning the value for the labels.
+        """
+        key = self._key(labels)
+
+        with self.lock:
+            self.functions[key] = function
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+            functions = dict(self.functions)
+
+        for key, function in functions.items():
+            values[key] = function()
+
+        return [
+            '{0}{1} {2}'.format(self.name, self._format_labels(key), value)
+            for key, value in values.items()
+        ]
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets.
+    """
+    metric_type = 'histogram'
+
+    def __init__(
+        self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS
+    ):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """
+        Add the observed value for the labels.
+        """
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            counts = self.values.get(key)
+
+            if counts is None:
+                # Bucket counts, the last one is +Inf, followed by sum
+                counts = [0] * (len(self.buckets) + 1) + [0.0]
+                self.values[key] = counts
+
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        lines = []
+
+        with self.lock:
+            values = {
+                key: list(counts) for key, counts in self.values.items()
+            }
+
+        bounds = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+
+        for key, counts in values.items():
+            total = 0
+
+            for bound, count in zip(bounds, counts):
+                total += count
+                lines.append('{0}_bucket{1} {2}'.format(
+                    self.name,
+                    self._format_labels(key, [('le', bound)]),
+                    total
+                ))
+
+            labels = self._format_labels(key)
+            lines.append(
+                '{0}_sum{1} {2}'.format(self.name, labels, counts[-1])
+            )
+            lines.append(
+                '{0}_count{1} {2}'.format(self.name, labels, total)
+            )
+
+        return lines
+
+
+class MetricsRegistry(object):
+    """
+    Collection of the metrics of a process.
+
+    Metrics are created on first use and shared by name, services in
+    one process tell their values apart by label.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def _get_metric(self, metric_class, name, documentation, **kwargs):
+        """
+        Return the metric by name, create it if it does not exist.
+        """
+        with self.lock:
+            metric = self.metrics.get(name)
+
+            if metric is None:
+                metric = metric_class(name, documentation, **kwargs)
+                self.metrics[name] = metric
+            elif not isinstance(metric, metric_class):
+                raise ValueError(
+                    'Metric {0} is registered as {1}.'.format(
+                        name,
+                        metric.metric_type
+                    )
+                )
+
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_metric(
+            Counter, name, documentation, labelnames=labelnames
+        )
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_metric(
+            Gauge, name, documentation, labelnames=labelnames
+        )
+
+    def histogram(
+        self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS
+    ):
+        return self._get_metric(
+            Histogram,
+            name,
+            documentation,
+            labelnames=labelnames,
+            buckets=buckets
+        )
+
+    def expose(self):
+        """
+        Return all metrics in Prometheus text format.
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Request handler serving the registry of the server.
+    """
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = self.server.registry.expose().encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """
+        Scrapes are not logged.
+        """
+        pass
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server exposing a metrics registry.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, registry):
+        super(MetricsServer, self).__init__(address, MetricsHandler)
+        self.registry = registry
+
+
+registry = MetricsRegistry()
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def start_metrics_server(port, host='127.0.0.1', metrics_registry=None):
+    """
+    Serve the registry on host and port from a daemon thread.
+
+    A server is started once per address, services in one process
+    share it.
+    """
+    with _servers_lock:
+        server = _servers.get((host, port))
+
+        if server is None:
+            server = MetricsServer((host, port), metrics_registry or registry)
+            thread = threading.Thread(
+                target=server.serve_forever,
+                name='metrics',
+                daemon=True
+            )
+            thread.start()
+            _servers[(host, port)] = server
+
+        return server
+
+
+def _escape(value):
+    """
+    Escape the label value for the exposition format.
+    """
+    return str(value).replace('\\', '\\\\').replace(
+        '"', '\\"'
+    ).replace('\n', '\\n')
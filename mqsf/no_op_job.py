@@ -16,10 +16,7 @@
 #
 # -*- coding: utf-8 -*-
 
-from mqsf import hookimpl
 
-
-@hookimpl
-def run_task(data, log_callback):
+def run_task(service, job_config, log):
     """Run the workload"""
     return
@@ -0,0 +1,270 @@
+# Copyright (c) 2023 SUSE LLC.  All rights reserved.
+#
+# This file is part of mqsf.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+from collections import OrderedDict
+
+from amqpstorm import AMQPChannelError
+
+try:
+    from pamqp import commands
+except ImportError:  # pamqp < 3
+    from pamqp import specification as commands
+
+
+class ChannelPool(object):
+    """
+    Pool of publisher channels with one channel per publishing thread.
+
+    Channels are opened lazily the first time a thread publishes and
+    are kept separate from the consumer channel. The pool is bounded
+    by the number of threads that publish, e.g. the scheduler thread
+    pool and the consumer thread.
+
+    Attributes
+
+    * :attr:`open_channel`
+      Callable returning a new channel ready for publishing
+    """
+    def __init__(self, open_channel):
+        self.open_channel = open_channel
+        self.lock = threading.Lock()
+        self.channels = []
+        self._local = threading.local()
+
+    def get_channel(self):
+        """
+        Return the channel of the calling thread, open it if required.
+        """
+        channel = getattr(self._local, 'channel', None)
+
+        if not channel or channel.is_closed:
+            channel = self.open_channel()
+            self._local.channel = channel
+
+            with self.lock:
+                self.channels = [
+                    open_channel for open_channel in self.channels
+                    if open_channel.is_open
+                ]
+                self.channels.append(channel)
+
+        return channel
+
+    def close(self):
+        """
+        Close all channels in the pool.
+        """
+        with self.lock:
+            for channel in self.channels:
+                if channel.is_open:
+                    channel.close()
+
+            self.channels = []
+
+    def discard(self, channel):
+        """
+        Remove a channel closed by the broker from the pool.
+
+        The thread owning the channel opens a new one on its next
+        publish as the channel is closed.
+        """
+        with self.lock:
+            if channel in self.channels:
+                self.channels.remove(channel)
+
+
+class PipelinedChannel(object):
+    """
+    Publisher channel with pipelined delivery confirmations.
+
+    Publishes return as soon as the message is written. Up to window
+    messages may be unconfirmed at a time, they are tracked by the
+    delivery tag the broker assigns in publish order. Broker acks and
+    nacks resolve the tracked messages and the matching on_confirm or
+    on_failure callback is passed to dispatch. A mandatory message
+    returned by the broker is failed when its ack arrives, the broker
+    sends the return right before the ack. Unconfirmed messages are
+    failed if the channel is closed by the broker, after the channel
+    is closed and passed to on_close so retries use a new channel.
+
+    Attributes
+
+    * :attr:`channel`
+      Channel used for publishing
+
+    * :attr:`window`
+      Max number of unconfirmed messages
+
+    * :attr:`dispatch`
+      Callable used to run the confirm callbacks off the io thread
+
+    * :attr:`timeout`
+      Seconds to wait for room in the window before failing a publish
+
+    * :attr:`on_close`
+      Callable passed the channel once it is closed by the broker
+    """
+    def __init__(self, channel, window, dispatch, timeout=60, on_close=None):
+        self.channel = channel
+        self.window = window
+        self.dispatch = dispatch
+        self.timeout = timeout
+        self.on_close = on_close
+        self.lock = threading.Lock()
+        self.unconfirmed = OrderedDict()
+
+        self._delivery_tag = 0
+        self._returns = 0
+        self._slots = threading.BoundedSemaphore(window)
+        self._on_frame = channel.on_frame
+
+        # Intercept confirms before the channel reports them unhandled
+        channel.on_frame = self.on_frame
+        channel.rpc_request(commands.Confirm.Select())
+
+    @property
+    def is_open(self):
+        return self.channel.is_open
+
+    @property
+    def is_closed(self):
+        return self.channel.is_closed
+
+    def close(self):
+        """
+        Close the channel and fail all unconfirmed messages.
+
+        Outstanding confirms are awaited for up to timeout seconds.
+        """
+        deadline = time.monotonic() + self.timeout
+        while self.unconfirmed and self.channel.is_open:
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(0.01)
+
+        if self.channel.is_open:
+            self.channel.close()
+
+        self._resolve(list(self.unconfirmed), confirmed=False)
+
+    def publish(
+        self, body, routing_key, exchange, properties=None,
+        mandatory=False, on_confirm=None, on_failure=None
+    ):
+        """
+        Publish the message without waiting for the broker confirm.
+
+        Blocks while the window of unconfirmed messages is full.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise AMQPChannelError(
+                'Timed out waiting for publisher confirms.'
+            )
+
+        with self.lock:
+            self._delivery_tag += 1
+            delivery_tag = self._delivery_tag
+            self.unconfirmed[delivery_tag] = (on_confirm, on_failure)
+
+            try:
+                self.channel.basic.publish(
+                    body=body,
+                    routing_key=routing_key,
+                    exchange=exchange,
+                    properties=properties,
+                    mandatory=mandatory
+                )
+            except Exception:
+                del self.unconfirmed[delivery_tag]
+                self._slots.release()
+                raise
+
+    def on_frame(self, frame_in):
+        """
+        Resolve publisher confirms, pass other frames to the channel.
+        """
+        if frame_in.name in ('Basic.Ack', 'Basic.Nack'):
+            returned = None
+
+            with self.lock:
+                if frame_in.multiple:
+                    delivery_tags = [
+                        tag for tag in self.unconfirmed
+                        if tag <= frame_in.delivery_tag
+                    ]
+                else:
+                    delivery_tags = [frame_in.delivery_tag]
+
+                if self._returns:
+                    # The returned message is the one acked last
+                    self._returns -= 1
+                    returned = frame_in.delivery_tag
+                    delivery_tags = [
+                        tag for tag in delivery_tags if tag != returned
+                    ]
+
+            if returned is not None:
+                self._resolve([returned], confirmed=False)
+
+            self._resolve(
+                delivery_tags,
+                confirmed=frame_in.name == 'Basic.Ack'
+            )
+            return
+
+        if frame_in.name == 'Basic.Return':
+            # Not passed on, the channel raises returns on the next call
+            with self.lock:
+                self._returns += 1
+            return
+
+        if frame_in.name in ('ContentHeader', 'ContentBody'):
+            # Content of a returned message, nothing is consumed here
+            return
+
+        if frame_in.name == 'Channel.Close':
+            # Close the channel before the failures are retried
+            self._on_frame(frame_in)
+
+            if self.on_close:
+                self.on_close(self)
+
+            self._resolve(list(self.unconfirmed), confirmed=False)
+            return
+
+        self._on_frame(frame_in)
+
+    def _resolve(self, delivery_tags, confirmed):
+        """
+        Release the window slots and dispatch the callbacks.
+        """
+        for delivery_tag in delivery_tags:
+            with self.lock:
+                callbacks = self.unconfirmed.pop(delivery_tag, None)
+
+            if callbacks is None:
+                continue
+
+            self._slots.release()
+            callback = callbacks[0] if confirmed else callbacks[1]
+
+            if callback:
+                self.dispatch(callback)
@@ -17,14 +17,21 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import time
 
-from amqpstorm import Connection
+from concurrent.futures import ThreadPoolExecutor
 
 # project
+from mqsf.connection import get_connection_manager
+from mqsf.transport import get_in_process_transport
 from mqsf.log.filter import BaseServiceFilter
-from mqsf.exceptions import MQConnectionException
+from mqsf.metrics import registry, start_metrics_server
+from mqsf.publisher import ChannelPool, PipelinedChannel
+from mqsf.codec import get_codec
+from mqsf.exceptions import MQSFCodecException, MQSFConfigException
 from mqsf.utils import setup_mq_log_handler
-from mqsf.config.base_config import BaseConfig
+from mqsf.json_format import JsonFormat
+from mqsf.config.base_config import BaseConfig, SERVICE_CONFIG_FILE_TEMPLATE
 
 
 class Service(object):
@@ -38,13 +45,35 @@ class Service(object):
 
     * :attr:`service_name`
       Name of service name
+
+    * :attr:`config`
+      Service config, read from /etc/mqsf/{service_name}_config.yaml
+      if not provided
+
+    * :attr:`transport`
+      Connection manager of the transport, by default the process
+      wide AMQP connection for the configured MQ settings or the
+      in-process transport
     """
-    def __init__(self, service_name):
+    def __init__(self, service_name, config=None, transport=None):
         self.channel = None
         self.connection = None
 
         self.service_name = service_name
-        self.config = BaseConfig(f'/etc/mqsf/{service_name}_config.yaml')  # TODO: determine how to set config file
+        # TODO: determine how to set config file
+        self.config = config or BaseConfig(
+            SERVICE_CONFIG_FILE_TEMPLATE.format(service_name)
+        )
+
+        try:
+            JsonFormat.set_backend(self.config.get_json_backend())
+        except ValueError as error:
+            raise MQSFConfigException(str(error))
+
+        try:
+            self.codec = get_codec(self.config.get_message_content_type())
+        except MQSFCodecException as error:
+            raise MQSFConfigException(str(error))
 
         # mq settings
         self.mq_host = self.config.get_mq_host()
@@ -54,8 +83,45 @@ class Service(object):
         self.mq_vhost = self.config.get_mq_vhost()
         self.mq_heartbeat = self.config.get_mq_heartbeat()
         self.mq_exchange_type = self.config.get_mq_exchange_type()
+        self.prefetch_count = self.config.get_prefetch_count()
+        self.max_priority = self.config.get_max_priority()
+        self.publish_confirm_mode = self.config.get_publish_confirm_mode()
+        self.publish_confirm_window = (
+            self.config.get_publish_confirm_window()
+        )
+
+        self._setup_metrics()
 
+        if transport:
+            self.transport = transport.acquire()
+        elif self.config.get_transport() == 'in_process':
+            self.transport = get_in_process_transport()
+        else:
+            self.transport = get_connection_manager(
+                self.mq_host,
+                self.mq_user,
+                self.mq_pass,
+                self.mq_port,
+                virtual_host=self.mq_vhost,
+                heartbeat=self.mq_heartbeat
+            )
+
+        if self.transport.codec:
+            # Messages do not leave the process, skip serialization
+            # and confirm each publish as it completes in memory.
+            self.codec = self.transport.codec
+            self.publish_confirm_mode = 'sync'
         self._open_connection()
+        self.publisher = ChannelPool(self._open_publish_channel)
+
+        self.confirm_executor = None
+        if self.publish_confirm_mode == 'pipelined':
+            # Confirm callbacks may publish again and must not
+            # run on the connection io thread.
+            self.confirm_executor = ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix='confirm'
+            )
 
         logging.basicConfig()
         self.log = logging.getLogger(
@@ -64,17 +130,67 @@ class Service(object):
         self.log.setLevel(logging.DEBUG)
         self.log.propagate = False
 
-        mq_handler = setup_mq_log_handler(
+        log_shipping = self.config.get_log_shipping()
+        if log_shipping == 'async':
+            log_options = {
+                'queue_size': self.config.get_log_queue_size(),
+                'batch_size': self.config.get_log_batch_size(),
+                'overflow': self.config.get_log_overflow(),
+                'spill_file': self.config.get_log_spill_file(
+                    self.service_name
+                )
+            }
+        else:
+            log_options = {}
+
+        self.mq_handler = setup_mq_log_handler(
             self.mq_host,
             self.mq_user,
             self.mq_pass,
-            self.mq_port
+            self.mq_port,
+            virtual_host=self.mq_vhost,
+            heartbeat=self.mq_heartbeat,
+            connection_manager=self.transport,
+            shipping=log_shipping,
+            **log_options
         )
-        self.log.addHandler(mq_handler)
+        self.log.addHandler(self.mq_handler)
         self.log.addFilter(BaseServiceFilter())
 
         self.post_init()
 
+    def _setup_metrics(self):
+        """
+        Create the service metrics and serve them if a port is set.
+
+        Metrics of all services in the process share one registry
+        and are labeled with the service name.
+        """
+        self.metrics = registry
+        self.publish_duration = self.metrics.histogram(
+            'mqsf_publish_duration_seconds',
+            'Time to publish a message.',
+            labelnames=('service',)
+        )
+        self.confirm_duration = self.metrics.histogram(
+            'mqsf_publish_confirm_duration_seconds',
+            'Time from publishing a message to the broker confirm.',
+            labelnames=('service',)
+        )
+
+        metrics_port = self._get_metrics_port()
+        if metrics_port:
+            start_metrics_server(
+                metrics_port,
+                host=self.config.get_metrics_host()
+            )
+
+    def _get_metrics_port(self):
+        """
+        Return the port metrics are served on, None if disabled.
+        """
+        return self.config.get_metrics_port()
+
     def post_init(self):
         """
         Post initialization method
@@ -96,8 +212,16 @@ class Service(object):
     def _declare_queue(self, queue):
         """
         Declare the queue and set as durable.
+
+        If a max priority is configured the queue is a priority queue.
         """
-        return self.channel.queue.declare(queue=queue, durable=True)
+        arguments = None
+        if self.max_priority:
+            arguments = {'x-max-priority': self.max_priority}
+
+        return self.channel.queue.declare(
+            queue=queue, durable=True, arguments=arguments
+        )
 
     def _get_queue_name(self, exchange, name):
         """
@@ -111,43 +235,104 @@ class Service(object):
         """
         Open connection or channel if currently closed or None.
 
+        The connection is shared with all components of the process
+        using the same MQ settings.
+
         Raises: MQConnectionException if connection
                 cannot be established.
         """
         if not self.connection or self.connection.is_closed:
-            try:
-                self.connection = Connection(
-                    self.mq_host,
-                    self.mq_user,
-                    self.mq_pass,
-                    self.mq_port,
-                    virtual_host=self.mq_vhost,
-                    heartbeat=self.mq_heartbeat
-                )
-            except Exception as e:
-                raise MQConnectionException(
-                    'Connection to MQ server failed: {0}'.format(e)
-                )
+            self.connection = self.transport.get_connection()
 
         if not self.channel or self.channel.is_closed:
             self.channel = self.connection.channel()
-            self.channel.confirm_deliveries()
 
-    def _publish(self, exchange, routing_key, message):
+    def _open_publish_channel(self):
+        """
+        Open a new channel for publishing with delivery confirmations.
+        """
+        channel = self.connection.channel()
+
+        if self.publish_confirm_mode == 'pipelined':
+            return PipelinedChannel(
+                channel,
+                self.publish_confirm_window,
+                self.confirm_executor.submit,
+                on_close=self.publisher.discard
+            )
+
+        channel.confirm_deliveries()
+        return channel
+
+    def _publish(
+        self, exchange, routing_key, message,
+        on_confirm=None, on_failure=None, priority=None
+    ):
         """
         Publish message to the provided exchange with the routing key.
+
+        The message is published on the channel of the calling thread,
+        never on the consumer channel.
+
+        The message is expected to be encoded with the service codec.
+
+        When the broker confirms or rejects the message on_confirm or
+        on_failure is called. In sync mode this happens before
+        returning, in pipelined mode once the confirm arrives.
         """
-        self.channel.basic.publish(
+        channel = self.publisher.get_channel()
+        properties = {
+            'content_type': self.codec.content_type,
+            'delivery_mode': 2
+        }
+
+        if priority is not None:
+            # The AMQP priority property is an octet
+            properties['priority'] = max(0, min(priority, 255))
+
+        start = time.monotonic()
+
+        if self.publish_confirm_mode == 'pipelined':
+            def confirmed():
+                self.confirm_duration.observe(
+                    time.monotonic() - start,
+                    service=self.service_name
+                )
+                if on_confirm:
+                    on_confirm()
+
+            channel.publish(
+                body=message,
+                routing_key=routing_key,
+                exchange=exchange,
+                properties=properties,
+                mandatory=True,
+                on_confirm=confirmed,
+                on_failure=on_failure
+            )
+            self.publish_duration.observe(
+                time.monotonic() - start,
+                service=self.service_name
+            )
+            return
+
+        confirmed = channel.basic.publish(
             body=message,
             routing_key=routing_key,
             exchange=exchange,
-            properties={
-                'content_type': 'application/json',
-                'delivery_mode': 2
-            },
+            properties=properties,
             mandatory=True
         )
 
+        # Sync publish returns once the broker confirmed the message
+        duration = time.monotonic() - start
+        self.publish_duration.observe(duration, service=self.service_name)
+        self.confirm_duration.observe(duration, service=self.service_name)
+
+        callback = on_confirm if confirmed else on_failure
+        if callback:
+            callback()
+
     def bind_queue(self, exchange, routing_key, name):
         """
         Bind queue on exchange to the provided routing key.
@@ -165,13 +350,37 @@ class Service(object):
     def close_connection(self):
         """
         If channel or connection open, stop consuming and close.
+
+        The publisher is closed before the consumer channel so the
+        acknowledgements of outstanding confirms can still be sent.
         """
         if self.channel and self.channel.is_open:
             self.channel.stop_consuming()
+
+        self.close_publisher()
+
+        if self.channel and self.channel.is_open:
+            self._handle_consumer_stopped()
             self.channel.close()
 
-        if self.connection and self.connection.is_open:
-            self.connection.close()
+        if self.mq_handler:
+            # The handler holds its own reference on the transport
+            self.log.removeHandler(self.mq_handler)
+            self.mq_handler.close()
+            self.mq_handler = None
+
+        if self.connection:
+            self.connection = None
+            self.transport.release()
+
+    def close_publisher(self):
+        """
+        Close the publisher channels and run outstanding confirm callbacks.
+        """
+        self.publisher.close()
+
+        if self.confirm_executor:
+            self.confirm_executor.shutdown(wait=True)
 
     def consume_queue(self, callback, queue_name, exchange):
         """
@@ -179,10 +388,42 @@ class Service(object):
         """
         queue = self._get_queue_name(exchange, queue_name)
         self._declare_queue(queue)
+
+        if self.prefetch_count:
+            self.channel.basic.qos(prefetch_count=self.prefetch_count)
+
         self.channel.basic.consume(
             callback=callback, queue=queue
         )
 
+    def start_consuming(self):
+        """
+        Process inbound messages until consuming is stopped.
+
+        Between batches of messages the consumer idle callback is
+        run on the consumer thread.
+        """
+        while self.channel.is_open and self.channel.consumer_tags:
+            # Bodies are left as bytes and decoded by content type
+            self.channel.process_data_events(auto_decode=False)
+            self._handle_consumer_idle()
+
+    def _handle_consumer_idle(self):
+        """
+        Callback when the consumer has drained the inbound messages.
+
+        Implementation in specialized service class
+        """
+        pass
+
+    def _handle_consumer_stopped(self):
+        """
+        Callback before the consumer channel is closed.
+
+        Implementation in specialized service class
+        """
+        pass
+
     def unbind_queue(self, queue, exchange, routing_key):
         """
         Unbind the routing_key from the queue on given exchange.
@@ -0,0 +1,260 @@
+# Copyright (c) 2023 SUSE LLC.  All rights reserved.
+#
+# This file is part of mqsf.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+
+import os
+import select
+import signal
+import time
+import traceback
+
+from mqsf.utils import adopt_job_files
+
+MIN_RESTART_DELAY = 1
+MAX_RESTART_DELAY = 60
+
+
+class Supervisor(object):
+    """
+    Run a service in several forked worker processes.
+
+    Each worker consumes the listener queue on its own connection and
+    keeps its jobs in its own job sub-directory, so workers never
+    recover each others jobs. Workers that exit are restarted, with
+    a growing delay if they keep failing. The supervisor waits for
+    child exits, signals and restart deadlines at once, so a delayed
+    restart never holds up the others. On SIGTERM or SIGINT the
+    workers are stopped gracefully, a second signal kills them.
+
+    Attributes
+
+    * :attr:`service_name`
+      Name of the service the workers run
+
+    * :attr:`processes`
+      Number of worker processes
+
+    * :attr:`workers`
+      Worker index by process id of the running workers
+
+    * :attr:`restarts`
+      Restart deadline by worker index of the exited workers
+    """
+    def __init__(
+        self, service_name, service_class, processes, job_directory, log
+    ):
+        self.service_name = service_name
+        self.service_class = service_class
+        self.processes = processes
+        self.job_directory = job_directory
+        self.log = log
+        self.workers = {}
+        self.restarts = {}
+        self.restart_delays = {}
+        self.started = {}
+        self.stopping = False
+
+    def run(self):
+        """
+        Start the workers and supervise them until all stopped.
+        """
+        moved = adopt_job_files(
+            self.job_directory,
+            self.processes,
+            self.log
+        )
+        if moved:
+            self.log.info(
+                'Moved {0} job files and journal segments to workers.'.format(
+                    moved
+                )
+            )
+
+        # Signals wake up the select on the pipe, SIGCHLD needs a
+        # handler to be delivered.
+        self.wakeup_fds = os.pipe()
+        for fd in self.wakeup_fds:
+            os.set_blocking(fd, False)
+
+        signal.set_wakeup_fd(self.wakeup_fds[1])
+        signal.signal(signal.SIGCHLD, self._handle_child)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for worker_id in range(self.processes):
+            self._start_worker(worker_id)
+
+        while True:
+            self._reap_workers()
+
+            if self.stopping:
+                self.restarts.clear()
+
+            self._start_due_workers()
+
+            if not self.workers and not self.restarts:
+                break
+
+            timeout = None
+            if self.restarts:
+                timeout = max(
+                    min(self.restarts.values()) - time.monotonic(),
+                    0
+                )
+
+            select.select([self.wakeup_fds[0]], [], [], timeout)
+            self._drain_wakeup()
+
+        signal.set_wakeup_fd(-1)
+        for fd in self.wakeup_fds:
+            os.close(fd)
+
+    def _handle_child(self, signum, frame):
+        """
+        Signal handler for SIGCHLD, exited workers are reaped in run.
+        """
+        pass
+
+    def _drain_wakeup(self):
+        """
+        Read all pending signal bytes from the wakeup pipe.
+        """
+        try:
+            while os.read(self.wakeup_fds[0], 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _reap_workers(self):
+        """
+        Collect exited workers and schedule their restart.
+        """
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+
+            if not pid:
+                return
+
+            worker_id = self.workers.pop(pid, None)
+            if worker_id is None or self.stopping:
+                continue
+
+            if os.WIFSIGNALED(status):
+                reason = 'signal {0}'.format(os.WTERMSIG(status))
+            else:
+                reason = 'status {0}'.format(os.WEXITSTATUS(status))
+
+            self.log.warning(
+                'Worker {0} of {1} exited with {2}, restarting.'.format(
+                    worker_id,
+                    self.service_name,
+                    reason
+                )
+            )
+            self._schedule_restart(worker_id)
+
+    def _schedule_restart(self, worker_id):
+        """
+        Set the deadline to start the worker again.
+
+        The delay doubles while the worker exits soon after starting
+        and is reset once it ran longer than the max delay.
+        """
+        now = time.monotonic()
+
+        if now - self.started[worker_id] > MAX_RESTART_DELAY:
+            delay = MIN_RESTART_DELAY
+        else:
+            delay = min(
+                self.restart_delays.get(worker_id, 0) * 2 or
+                MIN_RESTART_DELAY,
+                MAX_RESTART_DELAY
+            )
+
+        self.restart_delays[worker_id] = delay
+        self.restarts[worker_id] = now + delay
+
+    def _start_due_workers(self):
+        """
+        Start the workers whose restart deadline has passed.
+        """
+        now = time.monotonic()
+
+        for worker_id, deadline in list(self.restarts.items()):
+            if deadline <= now:
+                del self.restarts[worker_id]
+                self._start_worker(worker_id)
+
+    def _start_worker(self, worker_id):
+        """
+        Fork a worker process running the service.
+        """
+        pid = os.fork()
+
+        if pid:
+            self.workers[pid] = worker_id
+            self.started[worker_id] = time.monotonic()
+            return
+
+        # Worker process, the service handles the signals
+        signal.set_wakeup_fd(-1)
+        for fd in self.wakeup_fds:
+            os.close(fd)
+
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        exit_code = 1
+
+        try:
+            self.service_class(
+                service_name=self.service_name,
+                worker_id=worker_id
+            )
+            exit_code = 0
+        except SystemExit as error:
+            exit_code = error.code if isinstance(error.code, int) else 1
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(exit_code)
+
+    def stop(self, signum=None, frame=None):
+        """
+        Stop the workers, kill them if already stopping.
+        """
+        if self.stopping:
+            self.log.warning('Killing workers of {0}.'.format(
+                self.service_name
+            ))
+            sig = signal.SIGKILL
+        else:
+            self.log.info('Stopping workers of {0}.'.format(
+                self.service_name
+            ))
+            sig = signal.SIGTERM
+
+        self.stopping = True
+
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
@@ -0,0 +1,109 @@
+# Copyright (c) 2023 SUSE LLC.  All rights reserved.
+#
+# This file is part of mqsf.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# -*- coding: utf-8 -*-
+
+import os
+import threading
+
+from mqsf.codec import register_codec
+from mqsf.exceptions import MQSFCodecException
+from mqsf.fake_broker import FakeBroker, FakeConnectionManager
+
+OBJECT_CONTENT_TYPE = 'application/x-mqsf-object'
+
+_in_process_transport = None
+_in_process_lock = threading.Lock()
+
+
+class ObjectCodec(object):
+    """
+    Codec passing messages through as Python objects.
+
+    Only used by the in-process transport where messages never leave
+    the process. Bodies that are not dicts, e.g. received from a
+    broker, are rejected.
+    """
+    content_type = OBJECT_CONTENT_TYPE
+
+    @staticmethod
+    def encode(data):
+        return data
+
+    @staticmethod
+    def decode(body):
+        if not isinstance(body, dict):
+            raise MQSFCodecException(
+                'Message body is not an in-process message.'
+            )
+
+        return body
+
+
+class InProcessTransport(FakeConnectionManager):
+    """
+    Transport handing messages between services of one process.
+
+    Exchanges, queues and routing behave as on the broker, but the
+    job dicts are handed over in memory without serialization. The
+    dict belongs to the receiving service once published, a message
+    routed to several queues is copied for each further queue.
+
+    Messages waiting in the in-memory queues are lost if the process
+    exits, jobs already received are recovered from the job store.
+    All services of a pipeline using the in-process transport have to
+    run in the same process.
+
+    Attributes
+
+    * :attr:`codec`
+      Codec of the transport, used instead of the configured codec
+    """
+    codec = ObjectCodec
+
+    def __init__(self, broker=None):
+        super(InProcessTransport, self).__init__(broker or FakeBroker())
+
+
+def get_in_process_transport():
+    """
+    Return the in-process transport shared by the services of the process.
+
+    The transport is acquired for the caller and has to be released.
+    """
+    global _in_process_transport
+
+    with _in_process_lock:
+        if _in_process_transport is None:
+            _in_process_transport = InProcessTransport()
+
+        return _in_process_transport.acquire()
+
+
+def _reset_in_process_transport():
+    """
+    Forget the in-process transport of the parent in a forked child.
+    """
+    global _in_process_transport, _in_process_lock
+
+    _in_process_transport = None
+    _in_process_lock = threading.Lock()
+
+
+register_codec(ObjectCodec)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_in_process_transport)
@@ -17,27 +17,40 @@
 # -*- coding: utf-8 -*-
 
 import datetime
-import json
 import logging
 import os
 import random
+import re
 import requests
+import threading
+import time
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager, suppress
 from string import ascii_lowercase
-from tempfile import NamedTemporaryFile
-
-from mqsf.log.handler import MQHandler
+from tempfile import NamedTemporaryFile, mkstemp
+
+from mqsf.log.handler import (
+    AsyncFileHandler,
+    AsyncMQHandler,
+    MQHandler,
+    create_file_handler
+)
 from mqsf.exceptions import MQSFException, MQSFLogSetupException
 from mqsf.json_format import JsonFormat
 
+SEGMENT_TEMPLATE = 'journal-{0:08d}.log'
+SEGMENT_REGEX = re.compile(r'^journal-(\d{8})\.log$')
+DEDUP_INDEX = 'dedup.index'
+
 
 @contextmanager
 def create_json_file(data):
     try:
         temp_file = NamedTemporaryFile(delete=False)
         with open(temp_file.name, 'w') as json_file:
-            json_file.write(JsonFormat.json_message(data))
+            json_file.write(JsonFormat.json_compact(data))
         yield temp_file.name
     finally:
         with suppress(OSError):
@@ -104,12 +117,113 @@ def remove_file(file_path):
         pass
 
 
-def persist_json(file_path, data):
+class GroupCommit(object):
+    """
+    Batch the syncs of concurrent writers into a single sync.
+
+    Writers call commit after writing their data. The first writer
+    without a sync in progress becomes the leader, waits window seconds
+    for more writers to join and runs sync once for the whole group.
+    Writers arriving while a sync runs wait for the next one. commit
+    returns once a sync started after the caller's write has finished.
+
+    Attributes
+
+    * :attr:`sync`
+      Callable making all previous writes durable
+
+    * :attr:`window`
+      Seconds the leader waits for writers to join the group
+    """
+    def __init__(self, sync, window=0.0):
+        self.sync = sync
+        self.window = window
+        self.condition = threading.Condition()
+
+        self._requested = 0
+        self._committed = 0
+        self._syncing = False
+
+    def commit(self):
+        """
+        Block until the writes of the caller are durable.
+        """
+        with self.condition:
+            self._requested += 1
+            ticket = self._requested
+
+            while self._syncing and self._committed < ticket:
+                self.condition.wait()
+
+            if self._committed >= ticket:
+                return
+
+            self._syncing = True
+
+        committed = None
+        try:
+            if self.window:
+                time.sleep(self.window)
+
+            with self.condition:
+                target = self._requested
+
+            self.sync()
+            committed = target
+        finally:
+            with self.condition:
+                if committed:
+                    self._committed = max(self._committed, committed)
+
+                self._syncing = False
+                self.condition.notify_all()
+
+
+def fsync_directory(path):
+    """
+    Fsync the directory so renames within it are durable.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def persist_json(file_path, data, sync='none'):
     """
     Persist the json data to a file on disk.
+
+    The data is written to a temp file in the same directory and
+    renamed over file_path so a crash never leaves a truncated file.
+
+    Durability depends on sync:
+
+    * none: no fsync, the write is atomic but may be lost on a crash
+    * always: fsync the file before and the directory after the rename
     """
-    with open(file_path, 'w') as json_file:
-        json_file.write(JsonFormat.json_message(data))
+    directory, name = os.path.split(file_path)
+    fd, temp_path = mkstemp(
+        dir=directory or '.',
+        prefix='.{0}.'.format(name),
+        suffix='.tmp'
+    )
+
+    try:
+        with os.fdopen(fd, 'w') as json_file:
+            json_file.write(JsonFormat.json_compact(data))
+            json_file.flush()
+
+            if sync == 'always':
+                os.fsync(json_file.fileno())
+
+        os.replace(temp_path, file_path)
+    except BaseException:
+        remove_file(temp_path)
+        raise
+
+    if sync == 'always':
+        fsync_directory(directory or '.')
 
 
 def load_json(file_path):
@@ -117,7 +231,7 @@ def load_json(file_path):
     Load json from file and return dictionary.
     """
     with open(file_path, 'r') as json_file:
-        data = json.load(json_file)
+        data = JsonFormat.json_load(json_file)
 
     return data
 
@@ -130,12 +244,262 @@ def restart_job(job_file, callback):
     callback(job_config)
 
 
-def restart_jobs(job_dir, callback):
+def _get_job_files(job_dir):
+    """
+    Yield the paths of all job files in job_dir as they are listed.
+    """
+    with os.scandir(job_dir) as entries:
+        for entry in entries:
+            # Skip temp files, quarantine and journal directories
+            if not entry.name.startswith('job-') or \
+                    not entry.name.endswith('.json'):
+                continue
+
+            if entry.is_file():
+                yield entry.path
+
+
+def get_worker_directory(job_directory, worker_id):
+    """
+    Return the job sub-directory of the worker process.
+    """
+    return os.path.join(job_directory, 'worker-{0}'.format(worker_id), '')
+
+
+def get_journal_segments(journal_directory):
+    """
+    Return the ids of all segments in the journal directory in order.
+    """
+    segments = []
+
+    for name in os.listdir(journal_directory):
+        match = SEGMENT_REGEX.match(name)
+        if match:
+            segments.append(int(match.group(1)))
+
+    return sorted(segments)
+
+
+def adopt_journal(source, target):
+    """
+    Move the journal segments of the source job directory to target.
+
+    The segments are renumbered after the segments of the target
+    journal so they are replayed in order. Jobs are owned by a single
+    worker, a job never has records in both journals. Returns the
+    number of moved segments.
+    """
+    source_journal = os.path.join(source, 'journal')
+    target_journal = os.path.join(target, 'journal')
+
+    if not os.path.isdir(source_journal):
+        return 0
+
+    segments = get_journal_segments(source_journal)
+    if segments:
+        os.makedirs(target_journal, exist_ok=True)
+        target_segments = get_journal_segments(target_journal)
+        next_id = target_segments[-1] + 1 if target_segments else 1
+
+        for segment_id in segments:
+            os.replace(
+                os.path.join(source_journal, SEGMENT_TEMPLATE.format(
+                    segment_id
+                )),
+                os.path.join(target_journal, SEGMENT_TEMPLATE.format(
+                    next_id
+                ))
+            )
+            next_id += 1
+
+    with suppress(OSError):
+        os.rmdir(source_journal)
+
+    return len(segments)
+
+
+def adopt_dedup_index(source, job_directory):
+    """
+    Append the dedup index of the source directory to the shared index.
+
+    Worker directories of earlier runs may hold their own index. The
+    shared index is adopted before the workers start, duplicate ids
+    are merged when the index is replayed.
+    """
+    source_index = os.path.join(source, DEDUP_INDEX)
+
+    try:
+        with open(source_index, 'rb') as index_file:
+            data = index_file.read()
+    except FileNotFoundError:
+        return
+
+    # Drop a record torn by a crash, the leading newline ends a torn
+    # record of the shared index
+    data = data[:data.rfind(b'\n') + 1]
+    target_index = os.path.join(job_directory, DEDUP_INDEX)
+
+    with open(target_index, 'ab') as index_file:
+        index_file.write(b'\n' + data)
+
+    remove_file(source_index)
+    remove_file('{0}.lock'.format(source_index))
+
+
+def adopt_job_files(job_directory, workers, log=None):
+    """
+    Move jobs without a running worker to the worker directories.
+
+    Job files and journal segments in the job directory, e.g. from a
+    single process run, go to the first worker. Jobs of workers beyond
+    the number of workers go to the worker with the same remainder.
+    With a single process all worker jobs go to the job directory.
+    The dedup indexes of all worker directories are merged into the
+    shared index. Worker directories left with other files, e.g.
+    quarantined jobs, are logged. Returns the number of moved job
+    files and segments.
+    """
+    log = log or logging.getLogger('mqsf')
+    moved = 0
+    sources = [] if workers <= 1 else [(job_directory, 0)]
+    os.makedirs(job_directory, exist_ok=True)
+
+    with os.scandir(job_directory) as entries:
+        for entry in entries:
+            name = entry.name
+
+            if not entry.is_dir() or not name.startswith('worker-') or \
+                    not name[7:].isdigit():
+                continue
+
+            adopt_dedup_index(entry.path, job_directory)
+
+            worker_id = int(name[7:])
+            if workers <= 1 or worker_id >= workers:
+                sources.append((entry.path, worker_id % workers))
+
+    for source, worker_id in sources:
+        if workers <= 1:
+            target = job_directory
+        else:
+            target = get_worker_directory(job_directory, worker_id)
+
+        os.makedirs(target, exist_ok=True)
+
+        for job_file in list(_get_job_files(source)):
+            os.replace(
+                job_file,
+                os.path.join(target, os.path.basename(job_file))
+            )
+            moved += 1
+
+        moved += adopt_journal(source, target)
+
+        if source == job_directory:
+            continue
+
+        try:
+            os.rmdir(source)
+        except OSError:
+            log.warning(
+                'Directory {0} of a removed worker is left behind, '
+                'its jobs were moved to {1}.'.format(source, target)
+            )
+
+    return moved
+
+
+def quarantine_file(file_path, quarantine_dir):
+    """
+    Move the file into the quarantine directory.
+    """
+    os.makedirs(quarantine_dir, exist_ok=True)
+    os.replace(
+        file_path,
+        os.path.join(quarantine_dir, os.path.basename(file_path))
+    )
+
+
+def restart_jobs(
+    job_dir, callback, workers=4, log=None,
+    quarantine_dir=None, report_interval=5
+):
     """
     Restart all jobs in job_dir using callback.
+
+    Job files are streamed from the directory and decoded by a pool of
+    workers threads while callback runs in the calling thread in
+    directory order. Files that cannot be loaded or restarted are moved
+    to quarantine_dir and recovery continues. Recovery runs while the
+    service processes messages, files removed meanwhile belong to jobs
+    that finished and are skipped.
+
+    Progress is logged every report_interval seconds and a summary
+    once all jobs are restarted. The summary is also returned.
     """
-    for job_file in os.listdir(job_dir):
-        restart_job(os.path.join(job_dir, job_file), callback)
+    log = log or logging.getLogger('mqsf')
+    quarantine_dir = quarantine_dir or os.path.join(job_dir, 'quarantine')
+    summary = {
+        'recovered': 0, 'quarantined': 0, 'skipped': 0, 'seconds': 0.0
+    }
+
+    start = time.monotonic()
+    next_report = start + report_interval
+
+    def restart_loaded(job_file, future):
+        try:
+            callback(future.result())
+        except FileNotFoundError:
+            summary['skipped'] += 1
+        except Exception as error:
+            log.error(
+                'Quarantining job file {0}: {1}'.format(job_file, error)
+            )
+
+            try:
+                quarantine_file(job_file, quarantine_dir)
+            except FileNotFoundError:
+                summary['skipped'] += 1
+            else:
+                summary['quarantined'] += 1
+        else:
+            summary['recovered'] += 1
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+
+        for job_file in _get_job_files(job_dir):
+            pending.append((job_file, executor.submit(load_json, job_file)))
+
+            # Keep a bounded number of decoded files in memory
+            if len(pending) >= workers * 4:
+                restart_loaded(*pending.popleft())
+
+            if time.monotonic() >= next_report:
+                elapsed = time.monotonic() - start
+                log.info(
+                    'Recovered {0} jobs ({1:.0f} jobs/s).'.format(
+                        summary['recovered'],
+                        summary['recovered'] / elapsed
+                    )
+                )
+                next_report += report_interval
+
+        while pending:
+            restart_loaded(*pending.popleft())
+
+    summary['seconds'] = time.monotonic() - start
+    log.info(
+        'Recovery finished: {0} jobs recovered, {1} quarantined, '
+        '{2} already finished in {3:.2f}s.'.format(
+            summary['recovered'],
+            summary['quarantined'],
+            summary['skipped'],
+            summary['seconds']
+        )
+    )
+
+    return summary
 
 
 def handle_request(url, endpoint, method, job_data=None):
@@ -145,7 +509,7 @@ def handle_request(url, endpoint, method, job_data=None):
     If response is unsuccessful raise exception.
     """
     request_method = getattr(requests, method)
-    data = None if not job_data else JsonFormat.json_message(job_data)
+    data = None if not job_data else JsonFormat.json_compact(job_data)
     uri = ''.join([url, endpoint])
 
     response = request_method(uri, data=data)
@@ -164,9 +528,12 @@ def handle_request(url, endpoint, method, job_data=None):
     return response
 
 
-def setup_logfile(logfile):
+def setup_logfile(logfile, async_write=False, **kwargs):
     """
     Create log dir and log file if either does not already exist.
+
+    The keyword arguments configure rotation of the log file. With
+    async_write records are written from a background thread.
     """
     try:
         log_dir = os.path.dirname(logfile)
@@ -177,11 +544,10 @@ def setup_logfile(logfile):
             'Log setup failed: {0}'.format(e)
         )
 
-    logfile_handler = logging.FileHandler(
-        filename=logfile, encoding='utf-8'
-    )
+    if async_write:
+        return AsyncFileHandler(logfile, **kwargs)
 
-    return logfile_handler
+    return create_file_handler(logfile, **kwargs)
 
 
 def get_logging_formatter():
@@ -191,14 +557,49 @@ def get_logging_formatter():
     )
 
 
-def setup_mq_log_handler(host, username, password, port):
-    rabbit_handler = MQHandler(
-        host=host,
-        username=username,
-        password=password,
-        port=port,
-        routing_key='mqsf.logger'
-    )
+def setup_mq_log_handler(
+    host,
+    username,
+    password,
+    port,
+    virtual_host='/',
+    heartbeat=600,
+    connection_manager=None,
+    shipping='sync',
+    **kwargs
+):
+    """
+    Return the handler for shipping log records to MQ.
+
+    The handler shares the connection of the connection manager, by
+    default the process wide connection for the settings.
+    With async shipping the keyword arguments configure the queue
+    of the AsyncMQHandler.
+    """
+    if shipping == 'async':
+        rabbit_handler = AsyncMQHandler(
+            host=host,
+            username=username,
+            password=password,
+            port=port,
+            routing_key='mqsf.logger',
+            virtual_host=virtual_host,
+            heartbeat=heartbeat,
+            connection_manager=connection_manager,
+            **kwargs
+        )
+    else:
+        rabbit_handler = MQHandler(
+            host=host,
+            username=username,
+            password=password,
+            port=port,
+            routing_key='mqsf.logger',
+            virtual_host=virtual_host,
+            heartbeat=heartbeat,
+            connection_manager=connection_manager
+        )
+
     rabbit_handler.setFormatter(get_logging_formatter())
 
     return rabbit_handler
@@ -52,7 +52,10 @@ setup(
     install_requires=requirements,
     extras_require={
         'dev': dev_requirements,
-        'test': test_requirements
+        'test': test_requirements,
+        'orjson': ['orjson'],
+        'msgpack': ['msgpack'],
+        'cbor': ['cbor2']
     },
     license='Apache-2.0',
     zip_safe=False,